@@ -0,0 +1,96 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from llmake.markdown import parse_markdown
+from llmake.synth import synthetic_project, write_project
+
+# Fixtures shared with the tests, such as workdir.
+pytest_plugins = ["tests.conftest"]
+
+# A run fails when the median time of a benchmark at one size, divided by that at the next smaller size, grew to more
+# than this many times the same ratio in the baseline. Absolute medians of the same code differ by up to 2x between runs
+# on a loaded machine, these ratios by up to 1.5x, and a change in complexity moves them by the step between sizes.
+SCALING_TOLERANCE = 2.0
+
+# Median seconds of each benchmark run in this session, by test function and parameters.
+_medians: dict[tuple[str, tuple], float] = {}
+
+
+def pytest_configure(config):
+    # The baseline named in pytest.ini is next to it, whatever directory pytest runs from.
+    compare = getattr(config.option, "benchmark_compare", None)
+    if isinstance(compare, str) and (config.rootpath / compare).is_file():
+        config.option.benchmark_compare = str(config.rootpath / compare)
+
+
+@pytest.fixture(autouse=True)
+def record_median(request):
+    yield
+    # No stats with --benchmark-disable.
+    stats = getattr(request.node.funcargs.get("benchmark"), "stats", None)
+    if stats:
+        _medians[request.node.originalname, tuple(request.node.callspec.params.values())] = stats.stats.median
+
+
+def scaling_ratios(medians: dict[tuple[str, tuple], float]) -> dict[tuple[str, tuple], float]:
+    """Ratio of every median to that of the same benchmark at the next smaller size."""
+    ratios = {}
+    for (name, params), median in medians.items():
+        smaller = [p for n, p in medians if n == name and p < params]
+        if smaller:
+            ratios[name, params] = median / medians[name, max(smaller)]
+    return ratios
+
+
+def pytest_sessionfinish(session):
+    compare = getattr(session.config.option, "benchmark_compare", None)
+    if not isinstance(compare, str) or not Path(compare).is_file() or not _medians:
+        return
+    baseline = {
+        (b["fullname"].split("::")[-1].split("[")[0], tuple(b["params"].values())): b["stats"]["median"]
+        for b in json.loads(Path(compare).read_text())["benchmarks"]
+    }
+    expected = scaling_ratios(baseline)
+    worse = {
+        key: ratio
+        for key, ratio in scaling_ratios(_medians).items()
+        if key in expected and ratio > expected[key] * SCALING_TOLERANCE
+    }
+    if worse:
+        reporter = session.config.pluginmanager.get_plugin("terminalreporter")
+        reporter.write_line("")
+        reporter.section("scaling worse than the baseline", red=True)
+        for (name, params), ratio in worse.items():
+            reporter.write_line(
+                f"{name}{list(params)}: {ratio:.1f}x the next smaller size, was {expected[name, params]:.1f}x"
+            )
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+# Sizes at which each benchmark runs. Comparing the timings of neighbouring sizes shows how an operation scales.
+SIZES = [100, 1000, 4000]
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: f"{size}tasks")
+def size(request):
+    return request.param
+
+
+@pytest.fixture
+def markdown(size):
+    return synthetic_project(size, wiki_links=2, web_links=1, dependencies=2.5, section_lines=5)
+
+
+@pytest.fixture
+def project(markdown):
+    return parse_markdown(markdown)
+
+
+@pytest.fixture
+def project_dir(workdir):
+    def write(tasks: int):
+        return write_project(workdir, tasks, wiki_links=2, web_links=1, dependencies=2.5, section_lines=5)
+
+    return write
@@ -0,0 +1,38 @@
+from io import StringIO
+
+from llmake.makefile import create_makefile
+from llmake.markdown import Project
+from llmake.ninja import create_ninja_file
+from llmake.ninja_syntax import Writer
+
+
+def fresh(proj: Project):
+    # A new Project, so that the dependency graph is built again in every round.
+    return (Project(proj.prompt, proj.tasks, proj.context),), {}
+
+
+def test_create_makefile(benchmark, project):
+    makefile = benchmark.pedantic(lambda p: create_makefile("project.md", p), setup=lambda: fresh(project), rounds=5)
+    assert "all:" in makefile
+
+
+def test_create_ninja_file(benchmark, project):
+    ninja = benchmark.pedantic(lambda p: create_ninja_file("project.md", p), setup=lambda: fresh(project), rounds=5)
+    assert "rule query" in ninja
+
+
+def test_ninja_writer(benchmark, size):
+    def write():
+        writer = Writer(StringIO())
+        writer.rule("query", command="llmake query $in $out", restat=True)
+        for i in range(size):
+            writer.build(
+                f"result_{i}.md",
+                "query",
+                inputs=f"task_{i}.md",
+                implicit=[f"done_{j}" for j in range(max(0, i - 3), i)],
+                variables={"taskname": f"Task {i}"},
+            )
+        return writer.output.getvalue()
+
+    assert benchmark(write).count("build ") == size
@@ -0,0 +1,11 @@
+from llmake.markdown import get_context_links, parse_markdown
+
+
+def test_parse_markdown(benchmark, markdown):
+    proj = benchmark(parse_markdown, markdown)
+    assert proj.tasks
+
+
+def test_get_context_links(benchmark, markdown):
+    links = benchmark(get_context_links, markdown)
+    assert links
@@ -0,0 +1,12 @@
+from pathlib import Path
+
+import pytest
+
+from llmake.cli.main import create_prompt
+
+
+@pytest.mark.parametrize("tasks", [100, 1000])
+def test_create_prompt_all(benchmark, project_dir, tasks):
+    projfile = project_dir(tasks)
+    benchmark.pedantic(create_prompt, args=(str(projfile),), kwargs={"all_tasks": True}, rounds=10, warmup_rounds=1)
+    assert Path(f"task_task-{tasks - 1}.md").exists()
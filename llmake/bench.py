@@ -0,0 +1,77 @@
+import os
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from llmake import trace
+from llmake.markdown import load_project
+from llmake.plan import schedule
+from llmake.synth import write_project
+
+# How each mode builds the project in the current directory with jobs steps at once.
+MODES = {
+    "make": [["llmake", "project.md", "--query-jobs", "{jobs}"], ["make", "-j{jobs}"]],
+    "ninja": [["llmake", "project.md", "--builder", "ninja", "--query-jobs", "{jobs}"], ["ninja", "-j{jobs}"]],
+    "daemon": [
+        ["llmake", "project.md", "--builder", "ninja", "--daemon", "--query-jobs", "{jobs}"],
+        ["ninja", "-j{jobs}"],
+    ],
+    "run": [["llmake", "run", "project.md", "--jobs", "{jobs}"]],
+}
+
+
+@dataclass
+class BenchResult:
+    mode: str
+    tasks: int
+    seconds: float
+    # Wall time of every step of the build trace.
+    steps: list[float]
+    # Build time if llmake took no time at all, the queries taking only the time the model simulated.
+    ideal_seconds: float
+    failed: int
+
+    def percentile(self, p: float) -> float:
+        steps = sorted(self.steps)
+        return steps[min(len(steps) - 1, int(len(steps) * p / 100))] if steps else 0.0
+
+    def overhead(self) -> float:
+        return self.seconds - self.ideal_seconds
+
+
+def run_bench(directory: Path, mode: str, tasks: int, model: str, jobs: int, dependencies: float = 1.0) -> BenchResult:
+    """Build a synthetic project of tasks in directory with mode, against model, and time it.
+
+    The response cache is off so that every task queries the model. Queries of mock models record the time they
+    simulated, which gives the ideal build time: the same schedule with no time spent outside the model.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    # Nothing to download, and no spaces in file names, which make cannot handle.
+    write_project(
+        directory, tasks, results=False, wiki_links=0, web_links=0, dependencies=dependencies, section_lines=5
+    )
+    cache_dir = directory / ".llmake"
+    env = os.environ | {
+        "MODEL": model,
+        "LLMAKE_CACHE_DIR": str(cache_dir.resolve()),
+        "LLMAKE_NO_CACHE": "1",
+        # Daemons started by the build go away soon after it.
+        "LLMAKE_DAEMON_IDLE_TIMEOUT": "5",
+    }
+
+    start = time.monotonic()
+    for command in MODES[mode]:
+        args = [arg.format(jobs=jobs) for arg in command]
+        subprocess.run(args, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)  # noqa: S603
+    seconds = time.monotonic() - start
+
+    records = trace.load_trace(cache_dir / "trace.jsonl")
+    proj = load_project(str(directory / "project.md"))
+    simulated = {task.slug(): 0.0 for task in proj.tasks}
+    for r in records:
+        if r.get("step") == "query" and r.get("task") in simulated:
+            simulated[r["task"]] += r.get("simulated_seconds") or 0.0
+    ideal = schedule(proj, [simulated[task.slug()] for task in proj.tasks], jobs)
+    failed = sum(not (directory / task.result_filename()).exists() for task in proj.tasks)
+    return BenchResult(mode, tasks, seconds, [r["seconds"] for r in records], ideal, failed)
@@ -0,0 +1,261 @@
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import shutil
+import time
+from collections.abc import Callable, Iterator
+from os import getenv
+from pathlib import Path
+
+from llmake.files import temp_path
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Share of max_bytes an eviction frees, so that the next writes do not scan the store again right away.
+EVICT_HEADROOM = 0.1
+# Writes counted in the usage file before the store is scanned again to correct the count.
+USAGE_LINES = 1000
+# Size of the log of hit and miss events before it is added up into the totals.
+STATS_COMPACT_BYTES = 64 * 1024
+
+
+def cache_dir() -> Path:
+    """Root directory for everything llmake caches between runs."""
+    return Path(getenv("LLMAKE_CACHE_DIR", ".llmake"))
+
+
+def atomic_write(path: Path, content: str):
+    """Write content to a temp file next to path and rename it into place."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = temp_path(path)
+    try:
+        with tmp.open("x") as f:
+            f.write(content)
+        tmp.replace(path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class ResponseCache:
+    """Content addressed store of LLM responses, shared by concurrent llmake processes.
+
+    Entries are evicted least recently used first once the store grows past `max_bytes`. Concurrent
+    requests for the same key are coalesced: the first caller computes the response while others wait
+    for it to appear. A lock is taken over once its owner is gone, or for an owner on another host sharing the
+    cache, once it is older than `stale_lock_seconds`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES, stale_lock_seconds: float = 600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stale_lock_seconds = stale_lock_seconds
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, messages: list[dict], params: dict) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def _lock(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.lock"
+
+    def get(self, key: str) -> str | None:
+        entry = self._entry(key)
+        try:
+            content = entry.read_text()
+        except FileNotFoundError:
+            return None
+        # Bump the mtime so eviction sees this entry as recently used.
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(entry)
+        return content
+
+    def has(self, key: str) -> bool:
+        """Whether key has an entry, without marking it as used."""
+        return self._entry(key).exists()
+
+    def put(self, key: str, content: str):
+        atomic_write(self._entry(key), content)
+        self._grow(len(content.encode()))
+
+    def put_file(self, key: str, source: Path):
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = temp_path(entry)
+        shutil.copyfile(source, tmp)
+        tmp.replace(entry)
+        self._grow(source.stat().st_size)
+
+    @contextlib.contextmanager
+    def claim(self, key: str, poll_interval: float = 0.1) -> Iterator[str | None]:
+        """Yield the cached content for key, or None while holding the key so the caller can fill it.
+
+        Only one caller at a time gets None, the others wait until the entry appears.
+        """
+        while True:
+            content = self.get(key)
+            if content is not None:
+                self._count("hit")
+                yield content
+                return
+            if self._try_lock(key):
+                try:
+                    # Another process may have finished between our lookup and taking the lock.
+                    content = self.get(key)
+                    self._count("hit" if content is not None else "miss")
+                    yield content
+                    return
+                finally:
+                    with contextlib.suppress(FileNotFoundError):
+                        self._lock(key).unlink()
+            time.sleep(poll_interval)
+
+    def get_or_compute(self, key: str, compute: Callable[[], tuple[str, bool]]) -> tuple[str, bool]:
+        """Content for key and whether it came from the cache.
+
+        compute returns the content and whether it may be stored under key.
+        """
+        with self.claim(key) as content:
+            if content is not None:
+                return content, True
+            content, store = compute()
+            if store:
+                self.put(key, content)
+            return content, False
+
+    def _try_lock(self, key: str) -> bool:
+        lock = self._lock(key)
+        lock.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # The owner may have crashed without cleaning up, take the lock over once it is gone.
+            with contextlib.suppress(FileNotFoundError):
+                if self._stale(lock):
+                    lock.unlink()
+            return False
+        try:
+            os.write(fd, f"{platform.node()} {os.getpid()}".encode())
+        finally:
+            os.close(fd)
+        return True
+
+    def _stale(self, lock: Path) -> bool:
+        host, _, pid = lock.read_text().rpartition(" ")
+        if host == platform.node() and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+            return False
+        # Owned by another host, or by a process that has not written its pid yet.
+        return time.time() - lock.stat().st_mtime > self.stale_lock_seconds
+
+    def _grow(self, size: int):
+        """Count size more bytes in the store, and evict once the count passes max_bytes.
+
+        The usage file holds the size of the store at the last eviction, then the size of every entry written
+        since, one per line, appended with O_APPEND so concurrent processes never clobber each other.
+        """
+        usage = self.directory / "usage"
+        try:
+            fd = os.open(usage, os.O_APPEND | os.O_WRONLY)
+        except FileNotFoundError:
+            self.evict()
+            return
+        try:
+            os.write(fd, f"{size}\n".encode())
+        finally:
+            os.close(fd)
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            lines = usage.read_text().split()
+            if sum(map(int, lines)) <= self.max_bytes and len(lines) <= USAGE_LINES:
+                return
+        self.evict()
+
+    def evict(self):
+        """Scan the store, evict least recently used entries when it is over max_bytes, and record its size."""
+        entries = []
+        for path in self.directory.glob("*/*"):
+            if path.suffix or path.name.startswith("."):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * (1 - EVICT_HEADROOM):
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+                total -= size
+        atomic_write(self.directory / "usage", f"{total}\n")
+
+    def _count(self, event: str):
+        if event == "hit":
+            self.hits += 1
+        else:
+            self.misses += 1
+        # One byte per event, appended with O_APPEND so concurrent processes never clobber each other.
+        fd = os.open(self.directory / "stats", os.O_CREAT | os.O_APPEND | os.O_WRONLY)
+        try:
+            os.write(fd, b"h" if event == "hit" else b"m")
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > STATS_COMPACT_BYTES:
+            self._compact_stats()
+
+    def _totals(self) -> dict[str, int]:
+        try:
+            return json.loads((self.directory / "stats.json").read_text())
+        except (FileNotFoundError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+    def _compact_stats(self):
+        """Add the events of the log up into the totals of stats.json, and start a new log."""
+        log = self.directory / "stats"
+        taken = temp_path(log)
+        try:
+            log.replace(taken)
+        except FileNotFoundError:
+            # Another process is compacting it.
+            return
+        try:
+            events = taken.read_bytes()
+            totals = self._totals()
+            totals = {"hits": totals["hits"] + events.count(b"h"), "misses": totals["misses"] + events.count(b"m")}
+            atomic_write(self.directory / "stats.json", json.dumps(totals))
+        finally:
+            taken.unlink(missing_ok=True)
+
+    def stats(self) -> dict[str, int]:
+        try:
+            events = (self.directory / "stats").read_bytes()
+        except FileNotFoundError:
+            events = b""
+        totals = self._totals()
+        entries = [p for p in self.directory.glob("*/*") if not p.suffix and not p.name.startswith(".")]
+        return {
+            "hits": totals["hits"] + events.count(b"h"),
+            "misses": totals["misses"] + events.count(b"m"),
+            "entries": len(entries),
+            "bytes": sum(p.stat().st_size for p in entries),
+        }
+
+
+def response_cache() -> ResponseCache | None:
+    """The response cache configured by the environment, or None when caching is disabled."""
+    if getenv("LLMAKE_NO_CACHE"):
+        return None
+    max_bytes = int(getenv("LLMAKE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+    return ResponseCache(cache_dir() / "responses", max_bytes)
@@ -1,106 +1,433 @@
+import contextlib
+import glob
+import json
 import sys
-from collections.abc import Iterable
+import time
+from os import getenv
 from pathlib import Path
+from typing import Annotated
 
-from cyclopts import App
+from cyclopts import App, Parameter
 
 import llmake.context as ctx
+from llmake import trace
 from llmake.context import Context, LinkType
-from llmake.makefile import create_makefile
-from llmake.markdown import Task, parse_markdown
-from llmake.naming import slugify
-from llmake.ninja import create_ninja_file
+from llmake.files import atomic_output, maybe_write, write_depfile
+from llmake.graph import CycleError
+from llmake.makefile import write_makefile
+from llmake.markdown import Project, load_project, load_projects
+from llmake.ninja import write_ninja_file, write_projects_ninja_file
+from llmake.pool import DEFAULT_FETCH_DEPTH, DEFAULT_QUERY_DEPTH, Pools, parse_pool, slot
+from llmake.prompt import prompt_inputs, token_budget, write_prompt
+from llmake.retrieval import retrieval_chunks
 
 app = App()
 
 
+def project_files(patterns: tuple[str, ...]) -> list[str]:
+    """Expand the glob patterns among patterns, dropping repeated files."""
+    files = []
+    for pattern in patterns:
+        # Path.glob takes no absolute patterns.
+        files += sorted(glob.glob(pattern, recursive=True)) if any(c in pattern for c in "*?[") else [pattern]  # noqa: PTH207
+    return list(dict.fromkeys(files))
+
+
+def check_acyclic(proj: Project) -> Project:
+    """Return proj, or exit with an error when its tasks depend on each other in a cycle."""
+    try:
+        proj.levels()
+    except CycleError as e:
+        print(e)
+        sys.exit(-1)
+    return proj
+
+
 @app.default
-def create_ninja(file, builder="makefile"):
-    with Path(file).open() as f:
-        proj = parse_markdown(f.read())
+def create_ninja(
+    *files: str,
+    builder="makefile",
+    daemon: bool = False,
+    batch: bool = False,
+    fetch_all: bool = False,
+    prefix_cache: bool = False,
+    shard_size: int = 0,
+    query_jobs: int = DEFAULT_QUERY_DEPTH,
+    fetch_jobs: int = DEFAULT_FETCH_DEPTH,
+    pool: list[str] | None = None,
+    out_dir: str | None = None,
+):
+    """Generate a build file for the project.
 
+    At most `--query-jobs` LLM calls of `MODEL` and `--fetch-jobs` downloads per host run at once, whatever the
+    number of jobs of the build. `--pool NAME=DEPTH` sets another depth for the model or host NAME.
+
+    With `--daemon` the build steps go through `llmake-client`, which forwards them to a warm llmake
+    process instead of starting a new interpreter for every step. With `--batch` the prompts of all tasks
+    that can be built together are written by a single `create-prompt` call, and with `--fetch-all` every web page
+    is downloaded by a single `fetch-contexts` call. `--prefix-cache` passes the same flag to `create-prompt`.
+
+    The build file is written to a temp file that replaces the old one once complete. With `--shard-size`, ninja
+    build edges are split into subninja files of about that many tasks, each only rewritten when it changed.
+
+    Several project files, or glob patterns, build together from one `build.ninja`, with the files of each project
+    in a directory of its own under `--out-dir` (default `build`) and the web pages of all projects fetched once.
+    """
+    try:
+        pools = Pools(query_jobs, fetch_jobs, dict(parse_pool(spec) for spec in pool or []))
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+    paths = project_files(files)
+    if not paths:
+        print(f"No project files match {' '.join(files)}")
+        sys.exit(-1)
+    command = "llmake-client" if daemon else "llmake"
+
+    if len(paths) > 1 or out_dir:
+        if builder != "ninja" or fetch_all:
+            print("Building several projects together needs --builder ninja, and fetches pages one by one")
+            sys.exit(-1)
+        out_dir = out_dir or "build"
+        projects = dict(zip(paths, map(check_acyclic, load_projects(paths, out_dir))))
+        with atomic_output(Path("build.ninja")) as f:
+            write_projects_ninja_file(f, projects, out_dir, command, batch, prefix_cache, shard_size, pools)
+        return
+
+    [file] = paths
+    proj = check_acyclic(load_project(file))
     if builder == "ninja":
-        buildfile = create_ninja_file(file, proj)
-        with Path("build.ninja").open("w") as f:
-            f.write(buildfile)
+        with atomic_output(Path("build.ninja")) as f:
+            write_ninja_file(f, file, proj, command, batch, fetch_all, prefix_cache, shard_size, pools)
     else:
-        buildfile = create_makefile(file, proj)
-        with Path("makefile").open("w") as f:
-            f.write(buildfile)
+        with atomic_output(Path("makefile")) as f:
+            write_makefile(f, file, proj, command, batch, fetch_all, prefix_cache, pools)
 
 
 @app.command
-def fetch_context(context_type: LinkType, uri: str, output_file: str):
+def fetch_context(context_type: LinkType, uri: str, output_file: str, *, pool: str | None = None):
+    """Fetch a context into output_file.
+
+    With `--pool NAME=DEPTH` at most DEPTH fetches with the same pool NAME run at once on this machine.
+    """
     context = Context(context_type, "", uri)
-    result = ctx.fetch_context(context, str(Path.cwd()))
-    if result:
-        maybe_write(output_file, result)
-    else:
-        print(f"Failed to fetch context {context}")
-        sys.exit(-1)
+    with trace.step("fetch-context", target=output_file), pool_slot(pool):
+        result = ctx.fetch_context(context, str(Path.cwd()))
+        if result:
+            maybe_write(output_file, result)
+        else:
+            print(f"Failed to fetch context {context}")
+            sys.exit(-1)
 
 
 @app.command
-def create_prompt(input_file: str, task_name: str):
-    with Path(input_file).open() as f:
-        doc = parse_markdown(f.read())
-        task = None
-        for t in doc.tasks:
-            if slugify(t.name) == task_name:
-                task = t
-        if not task:
-            print(f"Cannot find task {task_name}")
+def fetch_contexts(file: str, *, jobs: int = 8, out_dir: str | None = None):
+    """Fetch every web page linked from the project concurrently, revalidating cached copies."""
+    from llmake.web import fetch_pages
+
+    with trace.step("fetch-contexts", target=file):
+        contexts = load_project(file, out_dir).web_contexts()
+        texts = fetch_pages([ctx.target for ctx in contexts], jobs)
+        failed = False
+        for context in contexts:
+            text = texts[context.target]
+            if text:
+                maybe_write(context.filename(), text)
+            else:
+                print(f"Failed to fetch context {context}")
+                failed = True
+        if failed:
             sys.exit(-1)
-        result = doc.prompt.copy()
-        result.append("# Contexts")
-        contexts = doc.context + task.context
-        for ctx, content in zip(contexts, load_fetched_context(contexts)):
-            result.append(f"## {ctx.name}")
-            result.append(content)
-        result.append("# Previous Finished Tasks")
-        for dep_task in doc.get_dependent_tasks(task):
-            result.append(f"## {dep_task.name}")
-            result.append(load_task_result(dep_task))
-        result.append("# Task")
-        result.extend(task.prompt)
-
-    maybe_write(task.filename(), "\n".join(result))
 
 
 @app.command
-def query(input_file: str, output_file: str):
-    from .query import query
+def hash_sections(file: str, *, out_dir: str | None = None):
+    """Write the hash of each task's section of the project, leaving unchanged hashes untouched.
 
-    result = query(input_file, output_file)
-    maybe_write(output_file, result)
+    Prompts depend on these files instead of the whole project file, so editing one task only rebuilds its
+    prompt. With `--out-dir` the files of the project are under that directory, as in a multi-project build.
+    """
+    with trace.step("hash-sections", target=file):
+        proj = load_project(file, out_dir)
+        for task in proj.tasks:
+            maybe_write(task.section_filename(), proj.section_digest(task) + "\n")
 
 
-def maybe_write(filename: str, content: str):
-    """Update the content of file only if the content is different."""
-    p = Path(filename)
-    if p.exists():
-        old = p.open().read()
-        if old == content:
+@app.command
+def create_prompt(
+    input_file: str,
+    *task_names: str,
+    all_tasks: Annotated[bool, Parameter(name="--all")] = False,
+    budget: int | None = None,
+    prefix_cache: bool = False,
+    chunks: int | None = None,
+    out_dir: str | None = None,
+    depfile: str | None = None,
+    depfile_target: list[str] | None = None,
+):
+    """Write the prompt file of each named task, parsing the project only once.
+
+    With `--all` every task whose dependencies already have results gets its prompt written. With `--budget`,
+    or `LLMAKE_TOKEN_BUDGET`, contexts and previous results are dropped until the prompt fits in that many
+    tokens of the `MODEL` tokenizer. With `--prefix-cache` the part shared by all prompts of the project comes
+    first and is marked, so that `query` can send it for provider prompt caching. With `--chunks`, or
+    `LLMAKE_RETRIEVAL_CHUNKS`, only that many chunks of each context go in, those scoring highest against the task
+    text with BM25. With `--out-dir` the files of the project are under that directory, as in a multi-project
+    build.
+
+    With `--depfile` the files the prompts are copied from, notes where their wiki links resolved to, web pages and
+    previous results, are written to that file in the make depfile format, as dependencies of the prompt files or of
+    the `--depfile-target` files.
+    """
+    doc = check_acyclic(load_project(input_file, out_dir))
+    by_slug = {t.slug(): t for t in doc.tasks}
+    missing = [name for name in task_names if name not in by_slug]
+    if missing:
+        print(f"Cannot find task {', '.join(missing)}")
+        sys.exit(-1)
+
+    tasks = [by_slug[name] for name in task_names]
+    if all_tasks:
+        tasks = []
+        for task in doc.tasks:
+            pending = [
+                t.result_filename() for t in doc.get_dependent_tasks(task) if not Path(t.result_filename()).exists()
+            ]
+            if pending:
+                print(f"Skipping {task.name}, missing {', '.join(pending)}")
+            else:
+                tasks.append(task)
+
+    budget = budget or token_budget()
+    chunks = chunks or retrieval_chunks()
+    for task in tasks:
+        with trace.step("create-prompt", task=task.slug(), target=task.filename()):
+            write_prompt(doc, task, budget, getenv("MODEL"), prefix_cache, chunks)
+    if depfile:
+        inputs = (path for task in tasks for path in prompt_inputs(doc, task))
+        write_depfile(depfile, depfile_target or [task.filename() for task in tasks], inputs)
+
+
+@app.command
+def query(input_file: str, output_file: str, *, cache: bool = True, stream: bool = False, pool: str | None = None):
+    """Query the LLM with the prompt in input_file.
+
+    With `--stream` the response is written to disk as it arrives, and time to first token and tokens per
+    second are added to its trace record. With `--pool NAME=DEPTH` at most DEPTH queries with the same pool NAME
+    run at once on this machine.
+    """
+    # The task of a prompt written by create-prompt, for grouping the trace by task.
+    task = Path(input_file).stem.removeprefix("task_")
+    with trace.step("query", task=task, target=output_file), pool_slot(pool):
+        if stream:
+            from .query import stream_query
+
+            stream_query(input_file, output_file, cache)
             return
-    with p.open("w") as f:
-        f.write(content)
+
+        from .query import query
+
+        result = query(input_file, output_file, cache)
+        maybe_write(output_file, result)
+
+
+@app.command
+def cache_stats():
+    """Print hit/miss counters and the size of the LLM response cache."""
+    from llmake.cache import response_cache
+
+    cache = response_cache()
+    if not cache:
+        print("Response cache is disabled by LLMAKE_NO_CACHE")
+        return
+    for name, value in cache.stats().items():
+        print(f"{name}: {value}")
 
 
-def load_fetched_context(contexts: list[Context]) -> Iterable[str]:
-    for context in contexts:
-        match context.context_type:
-            case LinkType.WIKI_LINK:
-                yield ctx.fetch_context(context) or ""
-            case LinkType.WEB_LINK:
-                with Path(context.filename()).open() as f:
-                    yield f.read()
-            case LinkType.HEAD_LINK:
-                yield ""
+@app.command
+def stats(*, by: str = "step", chrome: str | None = None):
+    """Summarize the build trace in `.llmake/trace.jsonl` by step or by task.
+
+    With `--chrome` the trace is also exported in Chrome trace event format to that file, to open in
+    chrome://tracing or https://ui.perfetto.dev.
+    """
+    records = trace.load_trace()
+    if not records:
+        print(f"No trace records in {trace.trace_path()}")
+        return
+
+    groups = trace.summarize(records, by)
+    columns = ["steps", "failed", "cache_hits", "hedges", "hedge_wins", "seconds", "prompt_tokens", "cached_tokens"]
+    columns += ["completion_tokens", "cost", "process_max_rss_kb"]
+    formats = {"seconds": ".2f", "cost": ".4f"}
+    width = max(len(by), *(len(name) for name in groups))
+    print(f"{by:<{width}}", *(f"{c:>{max(len(c), 8)}}" for c in columns))
+    for name, group in sorted(groups.items(), key=lambda g: -g[1]["seconds"]):
+        values = (f"{group[c]:>{max(len(c), 8)}{formats.get(c, '')}}" for c in columns)
+        print(f"{name:<{width}}", *values)
+
+    start = min(r["start"] for r in records)
+    end = max(r["start"] + r["seconds"] for r in records)
+    print(f"\n{len(records)} steps over {end - start:.2f}s wall time")
+
+    if chrome:
+        Path(chrome).write_text(json.dumps(trace.chrome_trace(records)))
+        print(f"Chrome trace written to {chrome}")
+
+
+@app.command
+def plan(
+    file: str,
+    *,
+    jobs: int = DEFAULT_QUERY_DEPTH,
+    budget: int | None = None,
+    prefix_cache: bool = False,
+    chunks: int | None = None,
+    output_tokens: int | None = None,
+):
+    """Estimate the tokens, cost and time of building the project, without querying the LLM or writing any file.
+
+    Prompts are assembled as `create-prompt` would with the same options, and tasks whose prompt did not change keep
+    their result. Output tokens and query time come from past queries of `MODEL` in the build trace, or from
+    `--output-tokens` and defaults. The wall time assumes `--jobs` queries at once, and tasks on the critical path,
+    the chain of dependencies taking longest, are marked with `*`. Input tokens marked `~` are only estimated, as
+    the prompt reads web pages not fetched yet or results of tasks that would run first.
+    """
+    from llmake.plan import plan_project
+
+    from .query import get_model
 
+    budget = budget if budget is not None else token_budget()
+    chunks = chunks or retrieval_chunks()
+    proj = check_acyclic(load_project(file))
+    result = plan_project(proj, get_model(), jobs, budget, prefix_cache, chunks, output_tokens)
+    critical = {t.task.name for t in result.critical_path}
+
+    columns = ["status", "input_tokens", "output_tokens", "seconds", "cost"]
+    width = max(len("task"), *(len(t.task.name) + 2 for t in result.tasks))
+    print(f"{'task':<{width}}", *(f"{c:>{max(len(c), 8)}}" for c in columns))
+    for t in result.tasks:
+        name = f"{t.task.name}{' *' if t.task.name in critical else ''}"
+        inputs = f"{'~' if t.estimated else ''}{t.input_tokens}"
+        cost = "?" if t.cost is None else f"{t.cost:.4f}"
+        values = [t.status, inputs, t.output_tokens, f"{t.seconds:.2f}", cost]
+        print(f"{name:<{width}}", *(f"{v:>{max(len(c), 8)}}" for c, v in zip(columns, values)))
+
+    running = result.running()
+    costs = [t.cost for t in running]
+    cached = sum(t.status == "cached" for t in result.tasks)
+    print(
+        f"\n{len(running)} of {len(result.tasks)} tasks would query {getenv('MODEL')}, {cached} answered from the cache"
+    )
+    print(
+        f"{sum(t.input_tokens for t in running)} input and {sum(t.output_tokens for t in running)} output tokens, "
+        + ("cost unknown" if None in costs else f"${sum(costs):.4f}")  # type: ignore [reportArgumentType]
+    )
+    path_seconds = sum(t.seconds for t in result.critical_path if t.status == "run")
+    print(f"{result.wall_seconds:.2f}s wall time with a query pool of depth {result.concurrency}")
+    print(f"Critical path {path_seconds:.2f}s: {' -> '.join(t.task.name for t in result.critical_path)}")
+
+
+@app.command
+def bench(
+    *,
+    tasks: int = 50,
+    model: str = "mock/latency=0.5",
+    modes: list[str] | None = None,
+    jobs: int = 8,
+    dependencies: float = 1.0,
+    directory: str | None = None,
+):
+    """Build a generated project of `--tasks` tasks with every mode and report how much time llmake itself adds.
+
+    Modes are `make`, `ninja`, `daemon` (ninja steps through `llmake-client`) and `run`, all by default, each running
+    `--jobs` steps at once against `--model`, by default a mock model answering after half a second. The report gives
+    the build time, tasks per second, the median and 95th percentile time of the build steps, the ideal build time if
+    queries took only the time the mock model simulated, and the overhead over it. Projects are built in a temp
+    directory, or under `--directory` to keep them.
+    """
+    import tempfile
+
+    from llmake.bench import MODES, run_bench
+
+    modes = modes or list(MODES)
+    if unknown := [mode for mode in modes if mode not in MODES]:
+        print(f"Unknown modes {', '.join(unknown)}, expected some of {', '.join(MODES)}")
+        sys.exit(-1)
 
-def load_task_result(task: Task) -> str:
-    with Path(task.result_filename()).open() as f:
-        return f.read()
+    with contextlib.ExitStack() as stack:
+        root = Path(directory) if directory else Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        if existing := [mode for mode in modes if (root / mode).exists()]:
+            print(f"{', '.join(str(root / mode) for mode in existing)} already exist, bench builds from scratch")
+            sys.exit(-1)
+        columns = ["seconds", "tasks/s", "p50", "p95", "ideal", "overhead", "failed"]
+        width = max(len("mode"), *(len(mode) for mode in modes))
+        print(f"{'mode':<{width}}", *(f"{c:>8}" for c in columns))
+        for mode in modes:
+            result = run_bench(root / mode, mode, tasks, model, jobs, dependencies)
+            values = [result.seconds, tasks / result.seconds, result.percentile(50), result.percentile(95)]
+            values += [result.ideal_seconds, result.overhead()]
+            print(f"{mode:<{width}}", *(f"{v:>8.2f}" for v in values), f"{result.failed:>8}")
+
+
+@app.command
+def run(file: str, *, jobs: int = 4, prefix_cache: bool = False):
+    """Build every task of the project in this process, running up to `jobs` steps at once."""
+    from llmake.executor import create_project_jobs, run_jobs
+
+    from .query import cancel_requests, get_model
+
+    proj = check_acyclic(load_project(file))
+    failures = run_jobs(create_project_jobs(proj, get_model(), prefix_cache), jobs, cancel_requests)
+    for name, error in failures.items():
+        print(f"{name} failed: {error}")
+    if failures:
+        sys.exit(-1)
+
+
+@app.command
+def watch(file: str, *, jobs: int = 4, prefix_cache: bool = False, interval: float = 0.5, debounce: float = 0.3):
+    """Build the project in this process, then rebuild the tasks affected by every change until interrupted.
+
+    The project file and the context files of its prompts are polled every `interval` seconds, and a rebuild
+    starts once they stopped changing for `debounce` seconds. Ctrl-C cancels the queries in flight.
+    """
+    from llmake.executor import create_project_jobs, run_jobs
+    from llmake.watch import watch
+
+    from .query import cancel_requests, get_model
+
+    model = get_model()
+    # Later edits introducing a cycle are reported while watching, until the next save.
+    check_acyclic(load_project(file))
+
+    def build(proj, tasks):
+        start = time.monotonic()
+        failures = run_jobs(create_project_jobs(proj, model, prefix_cache, tasks), jobs, cancel_requests)
+        for name, error in failures.items():
+            print(f"{name} failed: {error}")
+        print(f"Built {len(tasks)} of {len(proj.tasks)} tasks in {time.monotonic() - start:.2f}s, watching {file}")
+
+    try:
+        watch(file, build, interval, debounce)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+@contextlib.contextmanager
+def pool_slot(spec: str | None):
+    if not spec:
+        yield
+        return
+    try:
+        name, depth = parse_pool(spec)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+    start = time.perf_counter()
+    with slot(name, depth):
+        trace.annotate(pool=name, pool_wait=time.perf_counter() - start)
+        yield
 
 
 def run_app():
@@ -1,12 +1,19 @@
+import asyncio
 import sys
+import threading
+import time
+from contextlib import nullcontext
 from os import getenv
 from pathlib import Path
 
-from litellm import completion
+from llmake import trace
+from llmake.cache import response_cache
+from llmake.files import maybe_write, replace_if_changed, temp_path
+from llmake.mock import register_mock_provider
+from llmake.prompt import CACHE_BREAKPOINT
 
 
-def query(input_file: str, output_file: str) -> str:
-    messages = [{"content": Path(input_file).read_text(), "role": "user"}]
+def get_model() -> str:
     model = getenv("MODEL")
     if not model:
         print("Please set the MODEL environment variable to the model you want to use.")
@@ -15,5 +22,306 @@ def query(input_file: str, output_file: str) -> str:
         )
         print("https://docs.litellm.ai/docs/providers/openai#openai-chat-completion-models")
         sys.exit(-1)
-    response = completion(model=model, messages=messages)
-    return response.choices[0].message.content  # type: ignore [reportArgumentType]
+    return model
+
+
+def prompt_messages(prompt: str, model: str) -> list[dict]:
+    """Chat messages for a prompt file.
+
+    The part of the prompt before CACHE_BREAKPOINT is sent as its own block, marked for caching when the provider
+    supports prompt caching. Providers that cache prefixes automatically get the prompt without the marker.
+    """
+    from litellm.utils import supports_prompt_caching
+
+    marker = f"{CACHE_BREAKPOINT}\n"
+    if marker not in prompt:
+        return [{"content": prompt, "role": "user"}]
+    prefix, rest = prompt.split(marker, 1)
+    try:
+        explicit = supports_prompt_caching(model)
+    except Exception:
+        explicit = False
+    if not explicit:
+        return [{"content": prefix + rest, "role": "user"}]
+    blocks = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+    if rest:
+        blocks.append({"type": "text", "text": rest})
+    return [{"content": blocks, "role": "user"}]
+
+
+def usage_metrics(usage) -> dict:
+    """Input tokens of a litellm usage object, split into cache reads, cache writes and uncached tokens."""
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+    created = getattr(usage, "cache_creation_input_tokens", None) or 0
+    prompt_tokens = usage.prompt_tokens or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached,
+        "cache_creation_tokens": created,
+        "uncached_tokens": max(prompt_tokens - cached, 0),
+        "completion_tokens": usage.completion_tokens,
+    }
+
+
+def response_cost(model: str, response=None, usage=None) -> float | None:
+    """Cost in USD of a response, or of the token counts in usage. None for models litellm has no prices for."""
+    from litellm import completion_cost, cost_per_token
+
+    try:
+        if response is not None:
+            return completion_cost(completion_response=response)
+        prompt, completion = cost_per_token(
+            model=model, prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens
+        )
+        return prompt + completion
+    except Exception:
+        return None
+
+
+# Latency samples needed before a percentile hedge delay is trusted.
+MIN_HEDGE_SAMPLES = 20
+# Bytes at the end of the build trace the latency samples are taken from, a few hundred queries.
+HEDGE_TRACE_TAIL = 64 * 1024
+# Seconds a percentile hedge delay is reused for before the trace is read again, in long-lived processes.
+HEDGE_DELAY_MAX_AGE = 60.0
+
+# (trace path, model, setting) -> (monotonic time computed, delay).
+_hedge_delays: dict[tuple[Path, str, str], tuple[float, float | None]] = {}
+
+
+def hedge_delay(model: str, setting: str | None = None) -> float | None:
+    """Seconds to wait for a response before sending a hedge request, from LLMAKE_HEDGE.
+
+    The setting is a number of seconds, or a percentile such as p95 of the latency of the recent uncached queries
+    of model in the build trace. None when hedging is off, or when the trace has too few queries to tell. A
+    percentile is computed once every HEDGE_DELAY_MAX_AGE seconds per process.
+    """
+    setting = setting if setting is not None else getenv("LLMAKE_HEDGE")
+    if not setting:
+        return None
+    if not setting.startswith("p"):
+        return float(setting)
+    key = (trace.trace_path(), model, setting)
+    computed, delay = _hedge_delays.get(key, (None, None))
+    if computed is not None and time.monotonic() - computed < HEDGE_DELAY_MAX_AGE:
+        return delay
+    samples = sorted(
+        r["seconds"]
+        for r in trace.load_trace(tail=HEDGE_TRACE_TAIL)
+        if r.get("step") == "query" and r.get("model") == model and r.get("cache") == "miss" and r.get("ok")
+    )
+    if len(samples) >= MIN_HEDGE_SAMPLES:
+        delay = samples[min(len(samples) - 1, int(len(samples) * float(setting[1:]) / 100))]
+    else:
+        delay = None
+    _hedge_delays[key] = (time.monotonic(), delay)
+    return delay
+
+
+# Set to give up on every request this process has in flight, as when llmake watch is interrupted.
+cancel_requests = threading.Event()
+
+
+class RequestCancelledError(Exception):
+    pass
+
+
+def request_timeout() -> float | None:
+    timeout = getenv("LLMAKE_TIMEOUT")
+    return float(timeout) if timeout else None
+
+
+async def hedged_completion(
+    model: str, messages: list[dict], delay: float, fallback: str | None = None, **params
+) -> tuple[object, str, bool]:
+    """Send the request, and a hedge to fallback (or model again) when no response came within delay seconds.
+
+    The hedge also goes out as soon as the first request fails. The first response wins and the other request is
+    cancelled. Returns the response, the model that sent it and whether the hedge won.
+    """
+    from litellm import acompletion
+
+    first = hedge = None
+    try:
+        first = asyncio.ensure_future(acompletion(model=model, messages=messages, **params))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done and not first.exception():
+            return first.result(), model, False
+
+        hedge_model = fallback or model
+        hedge = asyncio.ensure_future(acompletion(model=hedge_model, messages=messages, **params))
+        trace.annotate(hedged=True)
+        pending = {first, hedge} - done
+        error = first.exception() if done else None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.exception():
+                    return task.result(), hedge_model if task is hedge else model, task is hedge
+                error = task.exception()
+    finally:
+        # Also when the caller gives up on the query, as on a timeout: requests left running are still billed.
+        for task in (first, hedge):
+            if task is not None:
+                task.cancel()
+    raise error  # type: ignore [reportGeneralTypeIssues]
+
+
+def raise_if_given_up(deadline: float | None, timeout: float | None):
+    """Raise once cancel_requests is set, or TimeoutError once the monotonic deadline passed."""
+    if cancel_requests.is_set():
+        raise RequestCancelledError
+    if deadline and time.monotonic() > deadline:
+        raise TimeoutError(f"No response within {timeout}s")
+
+
+async def cancellable(coroutine, timeout: float | None = None, poll: float = 0.1):
+    """Await coroutine, cancelling it after timeout seconds or once cancel_requests is set."""
+    task = asyncio.ensure_future(coroutine)
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=poll)
+            if not task.done() or cancel_requests.is_set():
+                raise_if_given_up(deadline, timeout)
+        return task.result()
+    finally:
+        task.cancel()
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def run_async(coroutine):
+    """Run coroutine on the event loop shared by all queries of the process, and wait for its result.
+
+    litellm keeps an async HTTP client per event loop, so queries only reuse connections if they all run on the
+    same loop. The coroutine sees the context variables of the caller, such as its trace step.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llmake-queries", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
+
+
+def complete(prompt: str, model: str, use_cache: bool = True) -> str:
+    """Query model with prompt. Token usage, cost and cache hits go to the trace of the running step.
+
+    With LLMAKE_HEDGE set, a slow request is hedged, see hedged_completion. LLMAKE_TIMEOUT limits the seconds a
+    query may take, hedges included. Setting cancel_requests makes the query raise RequestCancelledError.
+    """
+    from litellm import acompletion
+
+    register_mock_provider(model, getenv("LLMAKE_FALLBACK_MODEL"))
+    messages = prompt_messages(prompt, model)
+    params: dict = {}
+    trace.annotate(model=model)
+
+    async def single():
+        return await acompletion(model=model, messages=messages, **params), model, False
+
+    def fn() -> tuple[str, bool]:
+        delay = hedge_delay(model)
+        if delay is None:
+            coroutine = single()
+        else:
+            coroutine = hedged_completion(model, messages, delay, getenv("LLMAKE_FALLBACK_MODEL"), **params)
+        response, used, won = run_async(cancellable(coroutine, request_timeout()))
+        if delay is not None:
+            trace.annotate(hedge_delay=delay, hedge_won=won, response_model=used)
+        trace.annotate(
+            cache="miss", **usage_metrics(getattr(response, "usage", None)), cost=response_cost(used, response)
+        )
+        # An answer of the fallback model is not cached as the answer of model.
+        return response.choices[0].message.content, used == model  # type: ignore [reportAttributeAccessIssue]
+
+    cache = response_cache() if use_cache else None
+    if not cache:
+        return fn()[0]
+    content, hit = cache.get_or_compute(cache.key(model, messages, params), fn)
+    if hit:
+        trace.annotate(cache="hit")
+    return content
+
+
+def query(input_file: str, output_file: str, use_cache: bool = True) -> str:
+    return complete(Path(input_file).read_text(), get_model(), use_cache)
+
+
+def stream_query(input_file: str, output_file: str, use_cache: bool = True):
+    """Stream the completion straight into output_file.
+
+    Chunks go to a temp file next to the output that replaces it once the response is complete, and
+    only when its content changed. Time to first token and throughput go to the trace of the running step.
+    Between chunks, the stream is given up like other queries once LLMAKE_TIMEOUT passed or cancel_requests is set.
+    """
+    from litellm import completion
+
+    model = get_model()
+    register_mock_provider(model)
+    messages = prompt_messages(Path(input_file).read_text(), model)
+    output = Path(output_file)
+    cache = response_cache() if use_cache else None
+    key = cache.key(model, messages, {}) if cache else ""
+    trace.annotate(model=model)
+
+    with cache.claim(key) if cache else nullcontext() as cached:
+        if cached is not None:
+            trace.annotate(cache="hit")
+            maybe_write(output_file, cached)
+            return
+
+        tmp = temp_path(output)
+        start = time.monotonic()
+        first_token = None
+        chunks = 0
+        usage = None
+        timeout = request_timeout()
+        deadline = start + timeout if timeout else None
+        try:
+            with tmp.open("x") as f:
+                # The usage only arrives with the last chunk.
+                response = completion(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout,
+                )
+                for chunk in response:
+                    raise_if_given_up(deadline, timeout)
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    text = chunk.choices[0].delta.content  # type: ignore [reportAttributeAccessIssue]
+                    if not text:
+                        continue
+                    if first_token is None:
+                        first_token = time.monotonic() - start
+                    chunks += 1
+                    f.write(text)
+            if cache:
+                cache.put_file(key, tmp)
+            replace_if_changed(tmp, output)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    elapsed = time.monotonic() - start
+    generating = elapsed - (first_token or 0)
+    # Without usage in the last chunk, count roughly one token per chunk.
+    tokens = getattr(usage, "completion_tokens", None) or chunks
+    trace.annotate(
+        cache="miss",
+        time_to_first_token=first_token,
+        tokens=tokens,
+        tokens_per_second=tokens / generating if generating > 0 else None,
+        **usage_metrics(usage),
+        cost=response_cost(model, usage=usage) if usage else None,
+    )
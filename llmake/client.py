@@ -0,0 +1,87 @@
+"""Thin client forwarding llmake commands to a warm daemon process.
+
+Only the standard library is imported here so that each build step stays cheap to start.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from llmake.cache import cache_dir
+
+DEFAULT_IDLE_TIMEOUT = 300
+
+
+def socket_path() -> Path:
+    """Socket of the daemon serving the current directory and environment.
+
+    The daemon runs commands with the environment it was started with, so the settings that change
+    results are part of the name and a different MODEL or API key gets its own daemon.
+    """
+    keys = sorted(
+        k for k in os.environ if k == "MODEL" or k.startswith("LLMAKE_") or k.endswith(("_API_KEY", "_API_BASE"))
+    )
+    fingerprint = hashlib.sha256(json.dumps([(k, os.environ[k]) for k in keys]).encode()).hexdigest()[:12]
+    return cache_dir() / f"daemon-{fingerprint}.sock"
+
+
+def connect(path: Path) -> socket.socket | None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    return sock
+
+
+def start_daemon(path: Path, timeout: float = 30) -> socket.socket:
+    idle = os.environ.get("LLMAKE_DAEMON_IDLE_TIMEOUT", str(DEFAULT_IDLE_TIMEOUT))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.with_suffix(".log").open("a") as log:
+        subprocess.Popen(  # noqa: S603
+            [sys.executable, "-m", "llmake.daemon", str(path), "--idle-timeout", idle],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+        )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sock = connect(path)
+        if sock:
+            return sock
+        time.sleep(0.05)
+    raise RuntimeError(f"llmake daemon did not start, see {path.with_suffix('.log')}")
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not hasattr(socket, "AF_UNIX"):
+        # No unix sockets on this platform, run the command in this process instead.
+        from llmake.cli.main import app
+
+        app(argv)
+        return
+
+    path = socket_path()
+    sock = connect(path) or start_daemon(path)
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps({"argv": argv, "cwd": str(Path.cwd())}).encode() + b"\n")
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        print(f"llmake daemon exited without answering, see {path.with_suffix('.log')}", file=sys.stderr)
+        sys.exit(-1)
+    response = json.loads(line)
+    sys.stdout.write(response["output"])
+    sys.exit(response["code"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
+import hashlib
 import logging
-import os
-import os.path
 from dataclasses import dataclass
 from enum import StrEnum
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from llmake.naming import slugify
 
+if TYPE_CHECKING:
+    from llmake.files import FileRange
+
 
 class LinkType(StrEnum):
     WEB_LINK = "web_link"
@@ -19,14 +22,27 @@ class Context:
     context_type: LinkType
     name: str
     target: str
+    # Directory shared by the web pages of every project of a multi-project build. Pages in it are named after their
+    # URL, so that all projects linking a page share one copy.
+    directory: str = ""
 
     def slug(self):
         return slugify(self.name)
 
+    def note(self) -> str:
+        """Target without its `#Heading` or `#^block` anchor."""
+        return self.target.partition("#")[0]
+
+    def anchor(self) -> str:
+        return self.target.partition("#")[2]
+
     def filename(self):
+        if self.context_type == LinkType.WEB_LINK and self.directory:
+            digest = hashlib.sha256(self.target.encode()).hexdigest()[:8]
+            return str(Path(self.directory) / f"context_{slugify(self.target)[:60]}-{digest}.md")
         if self.context_type == LinkType.WEB_LINK:
             return f"context_{self.slug()}.md"
-        return f"{self.target}.md"
+        return f"{self.note()}.md"
 
 
 def fetch_context(context: Context, base_dir: str | None = None):
@@ -38,21 +54,34 @@ def fetch_context(context: Context, base_dir: str | None = None):
     return None
 
 
+def resolve_local_file(target: str, base_dir: str | None) -> Path | None:
+    from llmake.file_index import file_index
+
+    return file_index(Path(base_dir) if base_dir else Path.cwd()).resolve(target)
+
+
+def local_source(target: str, base_dir: str | None) -> "Path | FileRange | None":
+    """The note a wiki link target points to, or only the part of it under `note#Heading` or `note#^block`."""
+    from llmake.files import FileRange
+    from llmake.headings import note_index
+
+    note, _, anchor = target.partition("#")
+    path = resolve_local_file(note, base_dir)
+    if not path or not anchor:
+        return path
+    found = note_index(path).find(anchor)
+    if not found:
+        logging.info("No section %s in %s", anchor, path)
+        return None
+    return FileRange(path, *found)
+
+
 def fetch_local_file(target: str, base_dir: str | None):
-    if not base_dir:
-        base_dir = str(Path.cwd())
-    for root, _, files in os.walk(base_dir):
-        for filename in files:
-            if filename.startswith(target):
-                return (Path(root) / filename).open().read()
-    return None
+    source = local_source(target, base_dir)
+    return source.read_text() if source else None
 
 
 def fetch_external_link(target: str):
-    import newspaper
+    from llmake.web import fetch_pages
 
-    try:
-        return newspaper.article(target).text
-    except newspaper.ArticleException as e:
-        logging.info("Failed to fetch context: ", target, e)
-        return None
+    return fetch_pages([target])[target]
@@ -0,0 +1,131 @@
+import argparse
+import contextlib
+import fcntl
+import io
+import json
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+
+class _ThreadLocalStream(io.TextIOBase):
+    """Route writes to a per-thread buffer so concurrent commands keep their output apart."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, "stream", None) or self.default
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    @contextlib.contextmanager
+    def capture(self, buffer: io.StringIO):
+        self.local.stream = buffer
+        try:
+            yield
+        finally:
+            self.local.stream = None
+
+
+def run_command(argv: list[str]) -> tuple[int, str]:
+    from llmake.cli.main import app
+
+    buffer = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        for stream in (sys.stdout, sys.stderr):
+            if isinstance(stream, _ThreadLocalStream):
+                stack.enter_context(stream.capture(buffer))
+        try:
+            app(argv)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc(file=buffer)
+            code = 1
+    return code, buffer.getvalue()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self.last_active = time.monotonic()
+        self.active = 0
+        self.lock = threading.Lock()
+        super().__init__(str(path), Handler)
+
+    def watch_idle(self):
+        while True:
+            time.sleep(min(1.0, self.idle_timeout))
+            with self.lock:
+                idle = self.active == 0 and time.monotonic() - self.last_active > self.idle_timeout
+            if idle:
+                self.shutdown()
+                return
+
+
+class Handler(socketserver.StreamRequestHandler):
+    server: Server
+
+    def handle(self):
+        with self.server.lock:
+            self.server.active += 1
+        try:
+            request = json.loads(self.rfile.readline())
+            if request["cwd"] != str(Path.cwd()):
+                code, output = -1, f"llmake daemon serves {Path.cwd()}, not {request['cwd']}\n"
+            else:
+                code, output = run_command(request["argv"])
+            self.wfile.write(json.dumps({"code": code, "output": output}).encode() + b"\n")
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+                self.server.last_active = time.monotonic()
+
+
+def serve(path: Path, idle_timeout: float):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Only one daemon may own the socket, later starters simply exit and their client connects to the winner.
+    lock_file = path.with_suffix(".lock").open("w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return
+    path.unlink(missing_ok=True)
+
+    # Pay for the heavy imports once, every command served afterwards reuses them.
+    import litellm  # noqa: F401
+
+    import llmake.cli.main  # noqa: F401
+
+    sys.stdout = _ThreadLocalStream(sys.stdout)
+    sys.stderr = _ThreadLocalStream(sys.stderr)
+    with Server(path, idle_timeout) as server:
+        threading.Thread(target=server.watch_idle, daemon=True).start()
+        try:
+            server.serve_forever()
+        finally:
+            path.unlink(missing_ok=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve llmake commands over a unix socket.")
+    parser.add_argument("socket")
+    parser.add_argument("--idle-timeout", type=float, default=300)
+    args = parser.parse_args()
+    serve(Path(args.socket), args.idle_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import threading
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import llmake.context as ctx
+from llmake import trace
+from llmake.context import LinkType
+from llmake.files import maybe_write
+from llmake.markdown import Project, Task
+from llmake.prompt import token_budget, write_prompt
+from llmake.retrieval import retrieval_chunks
+
+
+@dataclass
+class Job:
+    name: str
+    fn: Callable[[], None]
+    deps: list[str] = field(default_factory=list)
+
+
+def run_jobs(jobs: list[Job], max_workers: int, cancel: threading.Event | None = None) -> dict[str, BaseException]:
+    """Run jobs concurrently, each one starting after all of its dependencies succeeded.
+
+    Returns the failures keyed by job name. Jobs depending on a failed job are skipped. On KeyboardInterrupt no
+    further job starts, and cancel is set for the running ones to give up early before the interrupt propagates.
+    """
+    by_name = {job.name: job for job in jobs}
+    waiting = {job.name: {dep for dep in job.deps if dep in by_name} for job in jobs}
+    dependents: dict[str, list[str]] = {name: [] for name in by_name}
+    for name, deps in waiting.items():
+        for dep in deps:
+            dependents[dep].append(name)
+
+    failures: dict[str, BaseException] = {}
+    running: dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        def submit_ready():
+            for name in [name for name, deps in waiting.items() if not deps]:
+                del waiting[name]
+                running[pool.submit(by_name[name].fn)] = name
+
+        try:
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        failures[name] = error
+                        continue
+                    for dependent in dependents[name]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(name)
+                submit_ready()
+        except KeyboardInterrupt:
+            if cancel:
+                cancel.set()
+            pool.shutdown(cancel_futures=True)
+            raise
+    return failures
+
+
+def is_stale(target: str, source: str) -> bool:
+    """Same rule as make: rebuild when the target is missing or older than its source."""
+    t, s = Path(target), Path(source)
+    return not t.exists() or t.stat().st_mtime < s.stat().st_mtime
+
+
+def create_project_jobs(
+    proj: Project, model: str, prefix_cache: bool = False, tasks: list[Task] | None = None
+) -> list[Job]:
+    """Jobs building the given tasks of proj, by default all of them.
+
+    Jobs of tasks left out are not created, the jobs created run as if those had already succeeded.
+    """
+    from llmake.cli.query import complete
+
+    jobs = []
+    budget = token_budget()
+    chunks = retrieval_chunks()
+
+    def fetch(context: ctx.Context):
+        def fn():
+            if Path(context.filename()).exists():
+                return
+            with trace.step("fetch-context", target=context.filename()):
+                result = ctx.fetch_context(context)
+                if not result:
+                    raise RuntimeError(f"Failed to fetch context {context}")
+                maybe_write(context.filename(), result)
+
+        return fn
+
+    def create_prompt(task):
+        def fn():
+            with trace.step("create-prompt", task=task.slug(), target=task.filename()):
+                write_prompt(proj, task, budget, model, prefix_cache, chunks)
+
+        return fn
+
+    def query(task):
+        def fn():
+            if not is_stale(task.result_filename(), task.filename()):
+                return
+            with trace.step("query", task=task.slug(), target=task.result_filename()):
+                maybe_write(task.result_filename(), complete(Path(task.filename()).read_text(), model))
+
+        return fn
+
+    tasks = proj.tasks if tasks is None else tasks
+    for task in tasks:
+        contexts = proj.context + task.context
+        web = [c for c in contexts if c.context_type == LinkType.WEB_LINK]
+        jobs += [Job(f"fetch:{c.filename()}", fetch(c)) for c in web]
+        deps = [f"fetch:{c.filename()}" for c in web]
+        deps += [f"query:{t.slug()}" for t in proj.graph.reduced_dependencies(task)]
+        jobs.append(Job(f"prompt:{task.slug()}", create_prompt(task), deps))
+        jobs.append(Job(f"query:{task.slug()}", query(task), [f"prompt:{task.slug()}"]))
+
+    return list({job.name: job for job in jobs}.values())
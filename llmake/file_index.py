@@ -0,0 +1,124 @@
+import bisect
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from llmake.cache import atomic_write, cache_dir
+
+# Files of builds that no wiki link points to: stamps, section hashes and depfiles.
+BUILD_SUFFIXES = (".stamp", ".hash", ".d")
+
+
+class FileIndex:
+    """Sorted table of file names under a directory tree, used to resolve wiki links.
+
+    The table is persisted in the cache directory together with the mtime of every directory it covers.
+    Reloading only rescans directories whose mtime changed, so resolving links in a large vault does not walk
+    the whole tree again. Hidden files and directories such as `.git` and `.llmake`, and the build files of
+    BUILD_SUFFIXES, are skipped.
+    """
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        # Relative directory -> (mtime_ns, files, subdirectories).
+        self.dirs: dict[str, tuple[int, list[str], list[str]]] = {}
+        self.table: list[tuple[str, str]] = []
+
+    def cache_file(self) -> Path:
+        digest = hashlib.sha256(str(self.base_dir.resolve()).encode()).hexdigest()[:16]
+        return cache_dir() / "file_index" / f"{digest}.json"
+
+    def load(self):
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            data = json.loads(self.cache_file().read_text())
+            self.dirs = {d: tuple(entry) for d, entry in data.items()}
+        self.refresh()
+        # A refresh finding changes already built the table.
+        if not self.table:
+            self._build_table()
+
+    def save(self):
+        atomic_write(self.cache_file(), json.dumps(self.dirs))
+
+    def refresh(self) -> bool:
+        """Rescan directories whose mtime changed. Returns whether the files or directories listed changed.
+
+        Directories whose listing stayed the same, as when a build replaces its own outputs, only get their new
+        mtime in memory, without rewriting the index.
+        """
+        changed = False
+        seen = set()
+        pending = ["."]
+        while pending:
+            rel = pending.pop()
+            seen.add(rel)
+            try:
+                mtime = (self.base_dir / rel).stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            entry = self.dirs.get(rel)
+            if not entry or entry[0] != mtime:
+                scanned = self._scan(rel, mtime)
+                changed |= not entry or scanned[1:] != tuple(entry[1:])
+                entry = self.dirs[rel] = scanned
+            pending.extend(str(Path(rel) / d) for d in entry[2])
+        for rel in set(self.dirs) - seen:
+            del self.dirs[rel]
+            changed = True
+        if changed:
+            self._build_table()
+            self.save()
+        return changed
+
+    def _scan(self, rel: str, mtime: int) -> tuple[int, list[str], list[str]]:
+        files, subdirs = [], []
+        with os.scandir(self.base_dir / rel) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith("."):
+                        subdirs.append(entry.name)
+                elif entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(BUILD_SUFFIXES):
+                    files.append(entry.name)
+        return mtime, sorted(files), sorted(subdirs)
+
+    def _build_table(self):
+        self.table = sorted((name, str(Path(rel) / name)) for rel, (_, files, _) in self.dirs.items() for name in files)
+
+    def resolve(self, target: str) -> Path | None:
+        """Find the file whose name starts with target.
+
+        Ambiguous prefixes resolve deterministically: an exact name or stem match wins, then the shortest
+        name, then the lexicographically smallest path.
+        """
+        candidates = []
+        for i in range(bisect.bisect_left(self.table, (target, "")), len(self.table)):
+            name, path = self.table[i]
+            if not name.startswith(target):
+                break
+            exact = name == target or Path(name).stem == target
+            candidates.append((not exact, len(name), path))
+        if not candidates:
+            return None
+        return self.base_dir / min(candidates)[2]
+
+
+_indexes: dict[Path, tuple[float, FileIndex]] = {}
+_lock = threading.Lock()
+
+
+def file_index(base_dir: Path, max_age: float = 1.0) -> FileIndex:
+    """Process wide index for base_dir, checked for changes at most every `max_age` seconds."""
+    with _lock:
+        checked, index = _indexes.get(base_dir, (0.0, None))
+        now = time.monotonic()
+        if index is None:
+            index = FileIndex(base_dir)
+            index.load()
+        elif now - checked > max_age:
+            index.refresh()
+        _indexes[base_dir] = (now, index)
+        return index
@@ -0,0 +1,126 @@
+import contextlib
+import filecmp
+import os
+import uuid
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO
+
+
+def maybe_write(filename: str, content: str):
+    """Update the content of file only if the content is different."""
+    p = Path(filename)
+    if p.exists():
+        old = p.read_text()
+        if old == content:
+            return
+    with p.open("w") as f:
+        f.write(content)
+
+
+def write_depfile(filename: str, targets: list[str], inputs: Iterable[Path]):
+    """Write a make style depfile, as `gcc -MD` does, saying that targets depend on inputs.
+
+    Inputs are written relative to the working directory, where make and ninja run.
+    """
+
+    def escape(path: str) -> str:
+        return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+    deps = "".join(f" \\\n  {escape(os.path.relpath(p))}" for p in dict.fromkeys(inputs))
+    maybe_write(filename, f"{' '.join(map(escape, targets))}:{deps}\n")
+
+
+def replace_if_changed(source: Path, dest: Path):
+    """Move source over dest, unless dest already has the same content; then source is dropped.
+
+    The comparison reads both files in chunks, so large outputs never have to fit in memory.
+    """
+    if dest.exists() and filecmp.cmp(source, dest, shallow=False):
+        source.unlink()
+        return
+    source.replace(dest)
+
+
+def temp_path(dest: Path) -> Path:
+    """Unique hidden path next to dest, for writing a file before renaming it into place."""
+    return dest.with_name(f".{dest.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+@contextlib.contextmanager
+def atomic_output(dest: Path, mode: str = "x") -> Iterator[IO]:
+    """Open a temp file to write dest through; it replaces dest once closed, unless the content is the same.
+
+    Readers never see a partly written file, and nothing is replaced if writing fails.
+    """
+    tmp = temp_path(dest)
+    try:
+        with tmp.open(mode) as f:
+            yield f
+        replace_if_changed(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def _kernel_copy(source: int, out: int, count: int) -> int:
+    if hasattr(os, "copy_file_range"):
+        with contextlib.suppress(OSError):
+            return os.copy_file_range(source, out, count)
+    return os.sendfile(out, source, None, count)
+
+
+def append_file(out: IO[bytes], source: Path, start: int = 0, end: int | None = None):
+    """Append bytes start to end of source to out, by default all of it.
+
+    The kernel copies them without passing through Python where the platform allows.
+    """
+    out.flush()
+    with source.open("rb", buffering=0) as f:
+        f.seek(start)
+        remaining = (os.fstat(f.fileno()).st_size if end is None else end) - start
+        with contextlib.suppress(OSError):
+            while remaining > 0:
+                copied = _kernel_copy(f.fileno(), out.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+        # Platforms without copy_file_range, or sendfile to a regular file, copy the rest in chunks.
+        while remaining > 0 and (chunk := f.read(min(remaining, 1 << 16))):
+            out.write(chunk)
+            remaining -= len(chunk)
+
+
+@dataclass(frozen=True)
+class FileRange:
+    """Bytes start to end of a file."""
+
+    path: Path
+    start: int
+    end: int
+
+    def read_bytes(self) -> bytes:
+        with self.path.open("rb") as f:
+            f.seek(self.start)
+            return f.read(self.end - self.start)
+
+    def read_text(self) -> str:
+        return self.read_bytes().decode()
+
+
+def write_parts(dest: Path, parts: Iterable[str | Path | FileRange], separator: str = "\n"):
+    """Write the strings and the content of the files in parts to dest, joined by separator.
+
+    Memory use does not grow with the size of the files, and dest is only replaced when its content changed.
+    """
+    with atomic_output(dest, "xb") as out:
+        for i, part in enumerate(parts):
+            if i:
+                out.write(separator.encode())
+            if isinstance(part, str):
+                out.write(part.encode())
+            elif isinstance(part, FileRange):
+                append_file(out, part.path, part.start, part.end)
+            else:
+                append_file(out, part)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from functools import cached_property
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from llmake.markdown import Task
+
+
+class CycleError(ValueError):
+    pass
+
+
+class TaskGraph:
+    """Dependency graph between the tasks of a project.
+
+    Dependencies naming a heading that is not a task are ignored. Tasks are numbered by their position in the
+    project, and every list of tasks returned keeps that order.
+    """
+
+    def __init__(self, tasks: list[Task]):
+        self.tasks = tasks
+        self.index = {t.name: i for i, t in enumerate(tasks)}
+        self.deps = [sorted({self.index[d] for d in t.dependency if d in self.index}) for t in tasks]
+
+    def task(self, name: str) -> Task | None:
+        i = self.index.get(name)
+        return None if i is None else self.tasks[i]
+
+    def dependencies(self, task: Task) -> list[Task]:
+        return [self.tasks[i] for i in self.deps[self.index[task.name]]]
+
+    @cached_property
+    def _levels(self) -> list[int]:
+        # Kahn's algorithm: a task's level is one more than the deepest of its dependencies.
+        dependents: list[list[int]] = [[] for _ in self.tasks]
+        waiting = [len(deps) for deps in self.deps]
+        for i, deps in enumerate(self.deps):
+            for d in deps:
+                dependents[d].append(i)
+        level = [0] * len(self.tasks)
+        ready = [i for i, n in enumerate(waiting) if n == 0]
+        done = 0
+        while ready:
+            i = ready.pop()
+            done += 1
+            for j in dependents[i]:
+                level[j] = max(level[j], level[i] + 1)
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    ready.append(j)
+        if done != len(self.tasks):
+            raise CycleError(f"Circular task dependency: {' -> '.join(self._find_cycle(waiting))}")
+        return level
+
+    def _find_cycle(self, waiting: list[int]) -> list[str]:
+        # Every task still waiting has a waiting dependency, so following them must come back around. The
+        # cycle is reported in "depends on" order.
+        i = next(i for i, n in enumerate(waiting) if n)
+        path: list[int] = []
+        while i not in path:
+            path.append(i)
+            i = next(d for d in self.deps[i] if waiting[d])
+        cycle = path[path.index(i) :] + [i]
+        return [self.tasks[j].name for j in cycle]
+
+    def levels(self) -> list[list[Task]]:
+        """Group tasks so that every task only depends on tasks of earlier groups."""
+        groups: list[list[Task]] = [[] for _ in range(max(self._levels, default=-1) + 1)]
+        for task, level in zip(self.tasks, self._levels):
+            groups[level].append(task)
+        return groups
+
+    @cached_property
+    def _reduced(self) -> list[list[int]]:
+        # ancestors[i] is a bitset of every task i depends on, directly or not. A dependency is redundant
+        # when it is also an ancestor of one of the other dependencies.
+        ancestors = [0] * len(self.tasks)
+        reduced: list[list[int]] = [[] for _ in self.tasks]
+        for i in sorted(range(len(self.tasks)), key=self._levels.__getitem__):
+            covered = 0
+            for d in sorted(self.deps[i], key=self._levels.__getitem__, reverse=True):
+                if not covered >> d & 1:
+                    reduced[i].append(d)
+                    covered |= ancestors[d] | 1 << d
+            ancestors[i] = covered
+            reduced[i].sort()
+        return reduced
+
+    def reduced_dependencies(self, task: Task) -> list[Task]:
+        """Dependencies of task that are not already implied by another of its dependencies."""
+        return [self.tasks[i] for i in self._reduced[self.index[task.name]]]
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import re
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from llmake.cache import atomic_write, cache_dir
+
+HEADING = re.compile(rb"^ {0,3}(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+FENCE = re.compile(rb"^ {0,3}(`{3,}|~{3,})")
+BLOCK_ID = re.compile(rb"(?:^|[ \t])\^([A-Za-z0-9-]+)[ \t]*$")
+LIST_ITEM = re.compile(rb"^[ \t]*(?:[-*+]|\d+[.)])[ \t]")
+
+
+@dataclass
+class NoteIndex:
+    """Byte ranges of the headings and block references of a markdown note.
+
+    headings holds (level, title, start, end) in file order, each range covering the heading and everything below
+    it up to the next heading of the same or a higher level. blocks maps block ids, as in `text ^id`, to the range
+    of the paragraph or list item carrying them.
+    """
+
+    headings: list[tuple[int, str, int, int]]
+    blocks: dict[str, tuple[int, int]]
+
+    def find(self, anchor: str) -> tuple[int, int] | None:
+        """Range of `^block-id`, or of a heading given by its title or a `#` separated path of titles."""
+        if anchor.startswith("^"):
+            return self.blocks.get(anchor[1:])
+        start, end, level = 0, None, 0
+        for title in anchor.split("#"):
+            match = next(
+                (
+                    h
+                    for h in self.headings
+                    if h[2] >= start and (end is None or h[2] < end) and h[0] > level and _same(h[1], title)
+                ),
+                None,
+            )
+            if match is None:
+                return None
+            level, _, start, end = match
+        return start, end
+
+
+def _same(title: str, anchor: str) -> bool:
+    return " ".join(title.split()).casefold() == " ".join(anchor.split()).casefold()
+
+
+def build_index(data: bytes) -> NoteIndex:
+    headings: list[list] = []
+    blocks: dict[str, tuple[int, int]] = {}
+    fence = None
+    offset = 0
+    # Start of the paragraph, and start and end of the block before it, for ids on a line of their own.
+    paragraph = None
+    previous = None
+    for line in data.splitlines(keepends=True):
+        start, offset = offset, offset + len(line)
+        text = line.rstrip(b"\r\n")
+        if fence:
+            if text.lstrip().startswith(fence):
+                fence = None
+            continue
+        if match := FENCE.match(text):
+            fence = match.group(1)[:3]
+            continue
+        if match := HEADING.match(text):
+            level = len(match.group(1))
+            for heading in headings:
+                if heading[3] is None and heading[0] >= level:
+                    heading[3] = start
+            headings.append([level, match.group(2).decode(errors="replace"), start, None])
+            paragraph = previous = None
+            continue
+        if not text.strip():
+            if paragraph is not None:
+                previous = (paragraph, start)
+            paragraph = None
+            continue
+        if match := BLOCK_ID.search(text):
+            block_id = match.group(1).decode()
+            if text.strip().startswith(b"^") and paragraph is None and previous:
+                blocks[block_id] = previous
+            elif LIST_ITEM.match(text):
+                blocks[block_id] = (start, offset)
+            else:
+                blocks[block_id] = (start if paragraph is None else paragraph, offset)
+        if paragraph is None:
+            paragraph = start
+    for heading in headings:
+        if heading[3] is None:
+            heading[3] = offset
+    return NoteIndex([tuple(h) for h in headings], blocks)  # type: ignore [reportArgumentType]
+
+
+_indexes: dict[str, tuple[list[int], NoteIndex]] = {}
+_lock = threading.Lock()
+
+
+def note_index(path: Path) -> NoteIndex:
+    """Index of the note at path, kept in memory and in the cache directory until the file changes."""
+    stat = path.stat()
+    version = [stat.st_mtime_ns, stat.st_size]
+    key = str(path.resolve())
+    with _lock:
+        cached = _indexes.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    cache_file = cache_dir() / "headings" / f"{hashlib.sha256(key.encode()).hexdigest()[:16]}.json"
+    index = None
+    try:
+        data = json.loads(cache_file.read_text())
+        if data["version"] == version:
+            index = NoteIndex([tuple(h) for h in data["headings"]], {k: tuple(v) for k, v in data["blocks"].items()})
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    if index is None:
+        index = build_index(path.read_bytes())
+        atomic_write(cache_file, json.dumps({"version": version, **asdict(index)}))
+    with _lock:
+        _indexes[key] = (version, index)
+    return index
@@ -1,57 +1,201 @@
 from io import StringIO
+from os import getenv
+from typing import TextIO
 
 from llmake.context import Context, LinkType
 from llmake.markdown import Project, Task
+from llmake.pool import Pools
 
+# Files removed by one `rm` of the clean rule. Make passes every recipe line to the shell as a single argument,
+# which may not be longer than 128 KiB on Linux.
+CLEAN_CHUNK = 200
 
-def create_makefile(projfile: str, proj: Project):
+
+def create_makefile(
+    projfile: str,
+    proj: Project,
+    command: str = "llmake",
+    batch: bool = False,
+    fetch_all: bool = False,
+    prefix_cache: bool = False,
+    pools: Pools | None = None,
+):
     buildfile = StringIO()
+    write_makefile(buildfile, projfile, proj, command, batch, fetch_all, prefix_cache, pools)
+    return buildfile.getvalue()
+
 
+def write_makefile(
+    buildfile: TextIO,
+    projfile: str,
+    proj: Project,
+    command: str = "llmake",
+    batch: bool = False,
+    fetch_all: bool = False,
+    prefix_cache: bool = False,
+    pools: Pools | None = None,
+):
+    # Make has no pools: the query and fetch steps wait for a slot of a semaphore shared between processes.
+    pools = pools or Pools()
+    query_pool = pools.query(getenv("MODEL"))
     all_tasks = [task.result_filename() for task in proj.tasks]
     all_files = []
     print("all:", " ".join(all_tasks), file=buildfile)
 
-    all_contexts = proj.context + [ctx for task in proj.tasks for ctx in task.context]
-    for ctx in all_contexts:
-        if ctx.context_type == LinkType.WEB_LINK:
-            buildfile.write(make_context(ctx.target, ctx.filename()))
-            all_files.append(ctx.filename())
+    web_contexts = proj.web_contexts()
+    if fetch_all and web_contexts:
+        buildfile.write(make_all_contexts(projfile, [ctx.filename() for ctx in web_contexts], command))
+        all_files.append(CONTEXTS_STAMP)
+    else:
+        for ctx in web_contexts:
+            buildfile.write(make_context(ctx.target, ctx.filename(), command, pools.fetch(ctx.target)))
+    all_files.extend(ctx.filename() for ctx in web_contexts)
 
+    # Prompts depend on the hash of their own task section rather than the whole project file, so editing one
+    # task rebuilds just that prompt.
+    if proj.tasks:
+        hashes = [task.section_filename() for task in proj.tasks]
+        buildfile.write(
+            make_restat(
+                hashes,
+                SECTIONS_STAMP,
+                [projfile],
+                f'@echo "Hashing task sections of {projfile}..."',
+                f"@{command} hash-sections {projfile}",
+            )
+        )
+        all_files.append(SECTIONS_STAMP)
+        all_files.extend(hashes)
+
+    # done_<task>.stamp is touched whenever the result of a task, or anything its prompt depends on, changes.
+    # Depending on the stamps of the reduced dependencies covers every result a prompt embeds without listing
+    # them all.
     for task in proj.tasks:
-        contexts = proj.context + task.context
-        context_deps = [ctx.filename() for ctx in contexts]
-        task_deps = [t.result_filename() for t in proj.get_dependent_tasks(task)]
-        buildfile.write(make_task(projfile, task, context_deps + task_deps))
-        all_files.append(task.filename())
-        all_files.append(task.result_filename())
-
-    print(
-        f"""
+        deps = [task.result_filename()] + [done_stamp(t) for t in proj.graph.reduced_dependencies(task)]
+        buildfile.write(make_stamp(done_stamp(task), deps))
+        all_files.append(done_stamp(task))
+
+    # Notes are found in the depfiles create-prompt writes, included at the end. Web pages are listed so that they
+    # are fetched first.
+    def prompt_deps(task: Task) -> list[str]:
+        context_deps = [ctx.filename() for ctx in proj.context + task.context if ctx.context_type == LinkType.WEB_LINK]
+        task_deps = [done_stamp(t) for t in proj.graph.reduced_dependencies(task)]
+        return [task.section_filename()] + context_deps + task_deps
+
+    # A prompt embeds the results of the tasks it depends on, so prompts can only be batched per level.
+    groups = proj.levels() if batch else [[task] for task in proj.tasks]
+    for group in groups:
+        deps = list(dict.fromkeys(dep for task in group for dep in prompt_deps(task)))
+        buildfile.write(make_prompt(projfile, group, deps, command, prefix_cache))
+        all_files.append(prompt_stamp(group))
+        all_files.append(prompt_depfile(group))
+        for task in group:
+            buildfile.write(make_query(task, command, query_pool))
+            all_files.append(task.filename())
+            all_files.append(task.result_filename())
+            all_files.append(query_stamp(task))
+
+    buildfile.write(make_clean(all_files))
+    if groups:
+        buildfile.write(f"\n-include {' '.join(prompt_depfile(group) for group in groups)}\n")
+
+
+def make_clean(files: list[str]):
+    chunks = (files[i : i + CLEAN_CHUNK] for i in range(0, len(files), CLEAN_CHUNK))
+    removes = "".join(f"""\t@rm -f "{'" "'.join(chunk)}"\n""" for chunk in chunks)
+    return f"""
 clean:
 \t@echo "Cleaning up generated files..."
-\t@rm "{'" "'.join(all_files)}"
-""",
-        file=buildfile,
-    )
-
-    return buildfile.getvalue()
+{removes}"""
 
 
-def make_context(url, output):
+def make_context(url, output, command="llmake", pool=None):
     return f"""
 {output}:
 \t@echo "Fetching webpage from {url}..."
-\t@llmake fetch-context web-link {url} {output}
+\t@{command} fetch-context{pool_option(pool)} web-link {url} {output}
 """
 
 
-def make_task(projfile, task: Task, deps):
+CONTEXTS_STAMP = "contexts.stamp"
+
+
+def make_all_contexts(projfile, outputs, command="llmake"):
+    # A stamp rather than a grouped target, which needs GNU make 4.3.
+    return make_restat(
+        outputs,
+        CONTEXTS_STAMP,
+        [],
+        f'@echo "Fetching all webpages of {projfile}..."',
+        f"@{command} fetch-contexts {projfile}",
+    )
+
+
+SECTIONS_STAMP = "sections.stamp"
+
+
+def make_restat(outputs, stamp, deps, *recipe):
+    """Rules for a recipe that leaves unchanged outputs untouched, like a ninja rule with restat.
+
+    The stamp records when the recipe last ran. Make checks the timestamps of the outputs again after their
+    own rules ran, so dependents of an output are only rebuilt when it actually changed. A deleted output runs
+    the recipe again.
+    """
+    lines = "".join(f"\t{line}\n" for line in recipe)
     return f"""
-{task.filename()}: {projfile} {" ".join(deps)}
-\t@echo "Generating prompt file: {task.filename()}..."
-\t@llmake create-prompt {projfile} {task.slug()}
+{stamp}: {" ".join(deps)}
+{lines}\t@touch $@
 
-{task.result_filename()}: {task.filename()}
-\t@echo "Querying LLM to generate result for task: {task.name}..."
-\t@llmake query {task.filename()} {task.result_filename()}
+{" ".join(outputs)}: {stamp}
+\t@test -f $@ || {{ rm -f $<; $(MAKE) --no-print-directory $<; }}
 """
+
+
+def done_stamp(task: Task) -> str:
+    return f"done_{task.slug()}.stamp"
+
+
+def make_stamp(stamp, deps):
+    return f"""
+{stamp}: {" ".join(deps)}
+\t@touch $@
+"""
+
+
+def prompt_stamp(tasks: list[Task]) -> str:
+    return f"prompt_{tasks[0].slug()}.stamp"
+
+
+def prompt_depfile(tasks: list[Task]) -> str:
+    return f"prompt_{tasks[0].slug()}.d"
+
+
+def make_prompt(projfile, tasks: list[Task], deps, command="llmake", prefix_cache=False):
+    filenames = " ".join(task.filename() for task in tasks)
+    return make_restat(
+        [task.filename() for task in tasks],
+        prompt_stamp(tasks),
+        deps,
+        f'@echo "Generating prompt file: {filenames}..."',
+        f"@{command} create-prompt {projfile} {' '.join(task.slug() for task in tasks)}"
+        f" --depfile {prompt_depfile(tasks)} --depfile-target {prompt_stamp(tasks)}"
+        + (" --prefix-cache" if prefix_cache else ""),
+    )
+
+
+def query_stamp(task: Task) -> str:
+    return f"query_{task.slug()}.stamp"
+
+
+def make_query(task: Task, command="llmake", pool=None):
+    return make_restat(
+        [task.result_filename()],
+        query_stamp(task),
+        [task.filename()],
+        f'@echo "Querying LLM to generate result for task: {task.name}..."',
+        f"@{command} query{pool_option(pool)} {task.filename()} {task.result_filename()}",
+    )
+
+
+def pool_option(pool: tuple[str, int] | None) -> str:
+    return f" --pool {pool[0]}={pool[1]}" if pool else ""
@@ -1,5 +1,12 @@
+import hashlib
+import json
+import os
 import re
-from dataclasses import dataclass
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import astuple, dataclass, replace
+from functools import cached_property
+from pathlib import Path
 from re import Pattern
 
 from mistletoe import Document
@@ -7,6 +14,7 @@ from mistletoe.block_token import Heading
 from mistletoe.span_token import Link, RawText, SpanToken, add_token, remove_token
 from mistletoe.token import Token
 
+from llmake.graph import TaskGraph
 from llmake.naming import slugify
 
 from .context import Context, LinkType
@@ -18,15 +26,23 @@ class Task:
     prompt: list[str]
     context: list[Context]
     dependency: list[str]
+    # Directory the files of the task go to, the working directory by default.
+    directory: str = ""
 
     def slug(self):
         return slugify(self.name)
 
+    def path(self, name: str) -> str:
+        return str(Path(self.directory) / name) if self.directory else name
+
     def filename(self):
-        return f"task_{self.slug()}.md"
+        return self.path(f"task_{self.slug()}.md")
 
     def result_filename(self):
-        return f"result_{self.slug()}.md"
+        return self.path(f"result_{self.slug()}.md")
+
+    def section_filename(self):
+        return self.path(f"section_{self.slug()}.hash")
 
 
 @dataclass
@@ -35,9 +51,39 @@ class Project:
     tasks: list[Task]
     context: list[Context]
 
+    @cached_property
+    def graph(self) -> TaskGraph:
+        return TaskGraph(self.tasks)
+
+    def web_contexts(self) -> list[Context]:
+        """Every web link of the project, one per context file."""
+        unique: dict[str, Context] = {}
+        for ctx in self.context + [ctx for task in self.tasks for ctx in task.context]:
+            if ctx.context_type == LinkType.WEB_LINK:
+                unique.setdefault(ctx.filename(), ctx)
+        return list(unique.values())
+
     def get_dependent_tasks(self, task: Task) -> list[Task]:
-        deps = set(task.dependency)
-        return [t for t in self.tasks if t.name in deps]
+        return self.graph.dependencies(task)
+
+    def levels(self) -> list[list[Task]]:
+        """Group tasks so that every task only depends on tasks of earlier groups."""
+        return self.graph.levels()
+
+    def section_digest(self, task: Task) -> str:
+        """Hash of every part of the project file that ends up in the prompt of task.
+
+        Editing the section of another task leaves it unchanged, so only the prompts of edited tasks are rebuilt.
+        """
+        parts = [
+            self.prompt,
+            [astuple(c) for c in self.context],
+            task.name,
+            task.prompt,
+            [astuple(c) for c in task.context],
+            [t.name for t in self.get_dependent_tasks(task)],
+        ]
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
 
 
 def _match_header(level: int, matcher: Pattern):
@@ -62,28 +108,79 @@ MATCH_LEVEL1_HEADER = _match_header(1, re.compile(".*"))
 MATCH_LEVEL2_HEADER = _match_header(2, re.compile(".*"))
 
 
+_projects: dict[tuple[str, str | None], tuple[tuple[int, int], Project]] = {}
+
+
+def output_directories(out_dir: str, projfile: str) -> tuple[str, str]:
+    """Directories of the task files of projfile and of the web pages of every project, in a build under out_dir."""
+    name = slugify(str(Path(projfile).with_suffix("")))
+    return str(Path(out_dir) / "projects" / name), str(Path(out_dir) / "contexts")
+
+
+def load_project(path: str, out_dir: str | None = None) -> Project:
+    """Parse a project file, reusing the previous result while the file is unchanged.
+
+    With out_dir, the files of the project go to the directories given by output_directories instead of the working
+    directory, so that the projects of one build do not overwrite each other.
+    """
+    stat = Path(path).stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _projects.get((path, out_dir))
+    if cached and cached[0] == version:
+        return cached[1]
+    proj = parse_markdown(Path(path).read_text())
+    if out_dir:
+        task_dir, contexts_dir = output_directories(out_dir, path)
+        proj = relocate(proj, task_dir, contexts_dir)
+    _projects[(path, out_dir)] = (version, proj)
+    return proj
+
+
+def load_projects(paths: list[str], out_dir: str | None = None, max_workers: int | None = None) -> list[Project]:
+    """Parse several project files in a process pool, keeping their order."""
+    if len(paths) < 2:
+        return [load_project(path, out_dir) for path in paths]
+    with ProcessPoolExecutor(min(max_workers or os.cpu_count() or 1, len(paths))) as pool:
+        return list(pool.map(load_project, paths, [out_dir] * len(paths)))
+
+
+def relocate(proj: Project, task_dir: str, contexts_dir: str) -> Project:
+    """Copy of proj keeping the files of its tasks in task_dir and its web pages in contexts_dir."""
+
+    def move(contexts: list[Context]) -> list[Context]:
+        return [replace(c, directory=contexts_dir) if c.context_type == LinkType.WEB_LINK else c for c in contexts]
+
+    tasks = [replace(task, context=move(task.context), directory=task_dir) for task in proj.tasks]
+    return Project(proj.prompt, tasks, move(proj.context))
+
+
 def parse_markdown(markdown: str):
     lines = markdown.splitlines()
-    doc = Document(lines)
-    children = list(doc.children or [])
-    # Task represents all task boundaries, ith task have line range [tasks[i], tasks[i+1])
-    task_lines = []
+    doc = _tokenize(lines)
+
+    # Walk the top level blocks once. Each block, with the links inside it, belongs either to the project
+    # prompt or to the task whose level 2 heading precedes it inside the tasks section.
+    task_starts: list[int] = []
+    task_links: list[list[Context]] = []
+    project_links: list[Context] = []
+    # Line where the task list ends, the rest of the file belongs to the project prompt again.
+    tasks_end = len(lines)
     in_task = False
-    for child in children:
+    for child in doc.children or []:
         if not in_task and MATCH_TASK_HEADER(child):
             in_task = True
-            continue
-        if in_task and MATCH_LEVEL2_HEADER(child):
-            task_lines.append(getattr(child, "line_number", -1) - 1)
-        if in_task and MATCH_LEVEL1_HEADER(child):
+        elif in_task and MATCH_LEVEL2_HEADER(child):
+            task_starts.append(getattr(child, "line_number", -1) - 1)
+            task_links.append([])
+        elif in_task and MATCH_LEVEL1_HEADER(child):
             in_task = False
-            task_lines.append(getattr(child, "line_number", -1) - 1)
-    if in_task:
-        task_lines.append(len(lines))
+            if task_starts:
+                tasks_end = getattr(child, "line_number", -1) - 1
+        links = task_links[-1] if in_task and task_links else project_links
+        _collect_links(child, links)
 
     tasks = []
-    for start, end in zip(task_lines, task_lines[1:]):
-        links = get_context_links(lines[start:end])
+    for start, end, links in zip(task_starts, task_starts[1:] + [tasks_end], task_links):
         dependency = [link.target for link in links if link.context_type == LinkType.HEAD_LINK]
         context = [link for link in links if link.context_type != LinkType.HEAD_LINK]
         if not dependency:
@@ -91,21 +188,18 @@ def parse_markdown(markdown: str):
         name = lines[start][2:].lstrip()
         tasks.append(Task(name, lines[start:end], context, dependency))
 
-    prompt_wihtout_task = lines[: task_lines[0]] + lines[task_lines[-1] :]
-    context = get_context_links(prompt_wihtout_task)
-
-    return Project(prompt_wihtout_task, tasks, context)
+    first_task = task_starts[0] if task_starts else tasks_end
+    prompt_without_task = lines[:first_task] + lines[tasks_end:]
+    return Project(prompt_without_task, tasks, project_links)
 
 
 class WikiLinkToken(SpanToken):
     pattern = re.compile(r"\[\[ *(.+?) *\]\]")
 
     def __init__(self, match):
-        target = match.group(1)
-        if "|" in target:
-            target, self.name = target.split()
-        else:
-            self.name = target
+        target, _, alias = match.group(1).partition("|")
+        target = target.strip()
+        self.name = alias.strip() or target
         if target.startswith("#"):
             self.target = target[1:]
             self.link_type = LinkType.HEAD_LINK
@@ -114,23 +208,31 @@ class WikiLinkToken(SpanToken):
             self.link_type = LinkType.WIKI_LINK
 
 
+# mistletoe keeps the registered span tokens and the document being parsed in module globals.
+_parse_lock = threading.Lock()
+
+
+def _tokenize(lines: str | list[str]) -> Document:
+    with _parse_lock:
+        add_token(WikiLinkToken)
+        try:
+            return Document(lines)
+        finally:
+            remove_token(WikiLinkToken)
+
+
+def _collect_links(token: Token, context: list[Context]):
+    if isinstance(token, WikiLinkToken):
+        context.append(Context(token.link_type, token.name, token.target))
+    if isinstance(token, Link):
+        children = list(token.children or [])
+        name = children[0].content if children and isinstance(children[0], RawText) else ""
+        context.append(Context(LinkType.WEB_LINK, name, token.target))
+    for child in token.children or []:
+        _collect_links(child, context)
+
+
 def get_context_links(prompt: str | list[str]) -> list[Context]:
-    add_token(WikiLinkToken)
-    doc = Document(prompt)
-    remove_token(WikiLinkToken)
-
-    context = []
-
-    def dfs(token: Token):
-        if isinstance(token, WikiLinkToken):
-            context.append(Context(token.link_type, token.name, token.target))
-        if isinstance(token, Link):
-            children = list(token.children or [])
-            name = children[0].content if children and isinstance(children[0], RawText) else ""
-            context.append(Context(LinkType.WEB_LINK, name, token.target))
-        if token.children:
-            for child in token.children:
-                dfs(child)
-
-    dfs(doc)
+    context: list[Context] = []
+    _collect_links(_tokenize(prompt), context)
     return context
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass, fields
+
+from llmake import trace
+
+PROVIDER = "mock"
+WORDS = "the a build task prompt result model token graph note page step cache file rule edge job pool".split()
+
+
+@dataclass(frozen=True)
+class MockSettings:
+    """Behavior of a mock model, set in its name as in `mock/tokens=200,latency=0.5,error_rate=0.1`.
+
+    Parts of the name that are not settings only tell models apart, as in `mock/slow,latency=10`.
+    """
+
+    # Words of every response, one token each.
+    tokens: int = 100
+    # Median seconds before the first token.
+    latency: float = 0.5
+    # Spread of the latency, the sigma of its log-normal distribution. 0 always waits latency.
+    jitter: float = 0.0
+    # Pace of the tokens after the first one. 0 sends them all at once.
+    tokens_per_second: float = 0.0
+    # Share of the requests failing with a rate limit error.
+    error_rate: float = 0.0
+    seed: int = 0
+
+    @classmethod
+    def parse(cls, model: str) -> "MockSettings":
+        types = {f.name: f.type for f in fields(cls)}
+        settings = {}
+        for part in model.removeprefix(f"{PROVIDER}/").split(","):
+            name, sep, value = part.partition("=")
+            if not sep:
+                continue
+            if name not in types:
+                raise ValueError(f"Unknown mock model setting {name!r}, expected one of {', '.join(types)}")
+            settings[name] = types[name](value)
+        if settings.get("tokens", 1) < 1:
+            raise ValueError("Mock models answer with at least one token")
+        return cls(**settings)
+
+
+_attempts: dict[str, int] = {}
+_lock = threading.Lock()
+
+
+@dataclass
+class MockResponse:
+    text: str
+    prompt_tokens: int
+    # Seconds to the first token, and between the next ones.
+    latency: float
+    interval: float
+    error: bool
+
+    @classmethod
+    def draw(cls, model: str, messages: list) -> "MockResponse":
+        """The response of model to messages.
+
+        The text only depends on the settings and the prompt. Latency and failures are drawn anew for every
+        attempt at the same prompt, from a sequence that is the same in every run.
+        """
+        settings = MockSettings.parse(model)
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        digest = hashlib.sha256(f"{settings.seed}:{prompt}".encode()).hexdigest()
+        with _lock:
+            attempt = _attempts[digest] = _attempts.get(digest, -1) + 1
+        # Seeded with strings, so the draws do not change with the hash seed of the process.
+        words = random.Random(digest)  # noqa: S311, reproducible, not security sensitive
+        timing = random.Random(f"{digest}:{attempt}")  # noqa: S311
+        text = " ".join(words.choice(WORDS) for _ in range(settings.tokens))
+        latency = settings.latency * timing.lognormvariate(0, settings.jitter)
+        interval = 1 / settings.tokens_per_second if settings.tokens_per_second else 0.0
+        error = timing.random() < settings.error_rate
+        return cls(text, len(prompt) // 4, latency, interval, error)
+
+    def seconds(self) -> float:
+        return self.latency + self.interval * max(len(self.text.split()) - 1, 0)
+
+    def check(self, model: str):
+        """Record the simulated time of the query in the trace, and fail if this attempt is to fail."""
+        import litellm
+
+        trace.annotate(simulated_seconds=self.latency if self.error else self.seconds())
+        if self.error:
+            raise litellm.RateLimitError("Mock rate limit", llm_provider=PROVIDER, model=model)
+
+    def usage(self) -> dict:
+        completion = len(self.text.split())
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": completion,
+            "total_tokens": self.prompt_tokens + completion,
+        }
+
+    def model_response(self, model_response):
+        from litellm.types.utils import Choices, Message, Usage
+
+        model_response.choices = [Choices(message=Message(content=self.text, role="assistant"), finish_reason="stop")]
+        model_response.usage = Usage(**self.usage())  # type: ignore [reportAttributeAccessIssue]
+        return model_response
+
+    def chunks(self) -> Iterator[tuple[float, dict]]:
+        """Seconds to wait before each streaming chunk, and the chunk."""
+        words = self.text.split()
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield (
+                self.latency if i == 0 else self.interval,
+                {
+                    "text": word if i == 0 else f" {word}",
+                    "is_finished": last,
+                    "finish_reason": "stop" if last else "",
+                    "usage": self.usage() if last else None,
+                    "index": 0,
+                    "tool_use": None,
+                },
+            )
+
+
+def mock_provider():
+    """Handler litellm calls for the mock/ models, which answer without any network access."""
+    from litellm import CustomLLM
+
+    class MockLLM(CustomLLM):
+        def completion(self, model, messages, *args, model_response=None, **kwargs):
+            response = MockResponse.draw(model, messages)
+            time.sleep(response.latency)
+            response.check(model)
+            time.sleep(response.seconds() - response.latency)
+            return response.model_response(model_response)
+
+        async def acompletion(self, model, messages, *args, model_response=None, **kwargs):
+            response = MockResponse.draw(model, messages)
+            await asyncio.sleep(response.latency)
+            response.check(model)
+            await asyncio.sleep(response.seconds() - response.latency)
+            return response.model_response(model_response)
+
+        def streaming(self, model, messages, *args, **kwargs) -> Iterator[dict]:  # type: ignore [reportIncompatibleMethodOverride]
+            response = MockResponse.draw(model, messages)
+            for i, (delay, chunk) in enumerate(response.chunks()):
+                time.sleep(delay)
+                if i == 0:
+                    response.check(model)
+                yield chunk
+
+        async def astreaming(self, model, messages, *args, **kwargs) -> AsyncIterator[dict]:  # type: ignore [reportIncompatibleMethodOverride]
+            response = MockResponse.draw(model, messages)
+            for i, (delay, chunk) in enumerate(response.chunks()):
+                await asyncio.sleep(delay)
+                if i == 0:
+                    response.check(model)
+                yield chunk
+
+    return MockLLM()
+
+
+def register_mock_provider(*models: str | None):
+    """Let litellm route the mock/ models among models to the mock provider."""
+    import litellm
+
+    if not any(model and model.startswith(f"{PROVIDER}/") for model in models):
+        return
+    with _lock:
+        if not any(p["provider"] == PROVIDER for p in litellm.custom_provider_map):
+            litellm.custom_provider_map.append({"provider": PROVIDER, "custom_handler": mock_provider()})
+            litellm.utils.custom_llm_setup()
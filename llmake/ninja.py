@@ -1,54 +1,231 @@
+from collections.abc import Iterator
 from io import StringIO
+from os import getenv
+from pathlib import Path
+from typing import TextIO
 
+from llmake.cache import cache_dir
 from llmake.context import Context, LinkType
-from llmake.markdown import Project, Task
+from llmake.files import atomic_output
+from llmake.markdown import Project, Task, output_directories
+from llmake.naming import slugify
+from llmake.pool import Pools
 
-from .ninja_syntax import Writer
+from .ninja_syntax import Writer, escape, escape_path
 
 
-def create_ninja_file(projfile: str, proj: Project):
+def create_ninja_file(
+    projfile: str,
+    proj: Project,
+    command: str = "llmake",
+    batch: bool = False,
+    fetch_all: bool = False,
+    prefix_cache: bool = False,
+    pools: Pools | None = None,
+):
     buildfile = StringIO()
-    writer = Writer(buildfile)
+    write_ninja_file(buildfile, projfile, proj, command, batch, fetch_all, prefix_cache, pools=pools)
+    return buildfile.getvalue()
+
+
+def write_ninja_file(
+    out: TextIO,
+    projfile: str,
+    proj: Project,
+    command: str = "llmake",
+    batch: bool = False,
+    fetch_all: bool = False,
+    prefix_cache: bool = False,
+    shard_size: int = 0,
+    pools: Pools | None = None,
+):
+    """Write the ninja file of the project to out.
+
+    LLM calls of the `MODEL` and downloads from each host run in their own pools, sized by pools, while local steps
+    use every job ninja has.
+    With shard_size, the build edges of the tasks go to subninja files of about that many tasks each, under
+    `.llmake/ninja`. A shard file is only replaced when its content changed.
+    """
+    writer = Writer(out)
+    web_contexts = proj.web_contexts()
+    query_pool, fetch_pools = write_pools(writer, pools or Pools(), web_contexts)
+    write_rules(writer, command, escape(projfile), prefix_cache, query_pool)
+
+    writer.rule(
+        name="fetch_all",
+        command=f"{command} fetch-contexts {escape(projfile)}",
+        description=f"Fetch all web pages of {escape(projfile)}",
+        restat=True,
+    )
+    if fetch_all and web_contexts:
+        # fetch-contexts limits its own concurrency.
+        writer.build(outputs=[ctx.filename() for ctx in web_contexts], rule="fetch_all")
+    else:
+        write_fetch_edges(writer, web_contexts, fetch_pools)
+
+    write_project_edges(writer, projfile, proj, batch, shard_size)
+
 
+def write_projects_ninja_file(
+    out: TextIO,
+    projects: dict[str, Project],
+    out_dir: str,
+    command: str = "llmake",
+    batch: bool = False,
+    prefix_cache: bool = False,
+    shard_size: int = 0,
+    pools: Pools | None = None,
+):
+    """Write one ninja file building every project, keyed by project file, loaded with load_project(..., out_dir).
+
+    The build edges of each project go to a subninja file in the directory of the project under out_dir. Web pages
+    are fetched once for all projects, and every step shares the same pools, so a single ninja run schedules the
+    work of all projects together.
+    """
+    writer = Writer(out)
+    web_contexts = list({c.filename(): c for proj in projects.values() for c in proj.web_contexts()}.values())
+    query_pool, fetch_pools = write_pools(writer, pools or Pools(), web_contexts)
+    # Each subninja file sets projfile for the edges of its project.
+    write_rules(writer, command, "$projfile", prefix_cache, query_pool, f" --out-dir {escape(out_dir)}")
+    write_fetch_edges(writer, web_contexts, fetch_pools)
+
+    for projfile, proj in projects.items():
+        path = Path(output_directories(out_dir, projfile)[0]) / "build.ninja"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_output(path) as f:
+            subninja = Writer(f)
+            subninja.variable("projfile", escape(projfile))
+            write_project_edges(subninja, projfile, proj, batch, shard_size)
+        writer.subninja(escape_path(str(path)))
+
+
+def write_pools(writer: Writer, pools: Pools, web_contexts: list[Context]) -> tuple[str, dict[str, tuple[str, int]]]:
+    """Declare the pool of the `MODEL` and a pool per host of web_contexts.
+
+    Returns the name of the query pool and the pool of each web page.
+    """
+    query_pool, query_depth = pools.query(getenv("MODEL"))
+    writer.pool(query_pool, query_depth)
+    fetch_pools = {ctx.target: pools.fetch(ctx.target) for ctx in web_contexts}
+    for name, depth in dict(fetch_pools.values()).items():
+        writer.pool(name, depth)
+    return query_pool, fetch_pools
+
+
+def write_rules(writer: Writer, command: str, projfile: str, prefix_cache: bool, query_pool: str, options: str = ""):
+    """Rules of the steps of a project; options is appended to the commands reading the project file."""
     writer.rule(
         name="fetch",
-        command="llmake fetch-context web-link $url $out",
+        command=f"{command} fetch-context web-link $url $out",
         description="Fetch web page $url",
     )
 
+    writer.rule(
+        name="hash_sections",
+        command=f"{command} hash-sections $in{options}",
+        description="Hash task sections of $in",
+        restat=True,
+    )
+
+    # create-prompt lists the files it actually read, notes wherever their wiki links resolved to, in a depfile.
     writer.rule(
         name="create_prompt",
-        command="llmake create-prompt $in $task",
+        command=f"{command} create-prompt {projfile} $task{options} --depfile $depfile"
+        + (" --prefix-cache" if prefix_cache else ""),
         description="Create prompt file for $task",
+        depfile="$depfile",
+        deps="gcc",
+        restat=True,
     )
 
     writer.rule(
         name="query",
-        command="llmake query $in $out",
+        command=f"{command} query $in $out",
         description="Query LLM engine for $taskname",
+        pool=query_pool,
+        restat=True,
     )
 
-    all_contexts = proj.context + [ctx for task in proj.tasks for ctx in task.context]
-    for ctx in all_contexts:
-        if ctx.context_type == LinkType.WEB_LINK:
-            writer.build(outputs=ctx.filename(), rule="fetch", variables={"url": ctx.target})
 
-    for task in proj.tasks:
-        contexts = proj.context + task.context
-        context_deps = [ctx.filename() for ctx in contexts]
-        task_deps = [t.result_filename() for t in proj.get_dependent_tasks(task)]
+def write_fetch_edges(writer: Writer, web_contexts: list[Context], fetch_pools: dict[str, tuple[str, int]]):
+    for ctx in web_contexts:
         writer.build(
-            outputs=task.filename(),
-            rule="create_prompt",
-            inputs=projfile,
-            implicit=context_deps + task_deps,
-            variables={"task": task.slug()},
+            outputs=ctx.filename(), rule="fetch", variables={"url": ctx.target}, pool=fetch_pools[ctx.target][0]
         )
+
+
+def write_project_edges(writer: Writer, projfile: str, proj: Project, batch: bool = False, shard_size: int = 0):
+    """Hash and task edges of the project, in shards of about shard_size tasks if given."""
+    # Prompts depend on the hash of their own task section rather than the whole project file. The hashes are only
+    # rewritten when they change, so with restat editing one task rebuilds just that prompt.
+    writer.build(outputs=[task.section_filename() for task in proj.tasks], rule="hash_sections", inputs=projfile)
+
+    # A prompt embeds the results of the tasks it depends on, so prompts can only be batched per level.
+    groups = proj.levels() if batch else [[task] for task in proj.tasks]
+    if not shard_size:
+        write_task_edges(writer, proj, groups)
+        return
+
+    shard_dir = cache_dir() / "ninja"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    prefix = slugify(str(Path(projfile).with_suffix("")))
+    shards = []
+    for i, shard in enumerate(shard_groups(groups, shard_size)):
+        path = shard_dir / f"{prefix}.{i}.ninja"
+        with atomic_output(path) as f:
+            write_task_edges(Writer(f), proj, shard)
+        writer.subninja(escape_path(str(path)))
+        shards.append(path)
+    for path in set(shard_dir.glob(f"{prefix}.*.ninja")) - set(shards):
+        path.unlink()
+
+
+def shard_groups(groups: list[list[Task]], size: int) -> Iterator[list[list[Task]]]:
+    shard: list[list[Task]] = []
+    tasks = 0
+    for group in groups:
+        shard.append(group)
+        tasks += len(group)
+        if tasks >= size:
+            yield shard
+            shard, tasks = [], 0
+    if shard:
+        yield shard
+
+
+def write_task_edges(writer: Writer, proj: Project, groups: list[list[Task]]):
+    """Build edges of the tasks in groups, with one create_prompt edge per group."""
+    # done_<task> stands for the result of a task together with everything its prompt depends on. Depending
+    # on the aliases of the reduced dependencies covers every result a prompt embeds without listing them all.
+    for task in (task for group in groups for task in group):
         writer.build(
-            outputs=task.result_filename(),
-            rule="query",
-            inputs=task.filename(),
-            variables={"taskname": task.name},
+            outputs=done_alias(task),
+            rule="phony",
+            inputs=[task.result_filename()] + [done_alias(t) for t in proj.graph.reduced_dependencies(task)],
         )
 
-    return buildfile.getvalue()
+    def prompt_deps(task: Task) -> list[str]:
+        # Notes are found in the depfile. Web pages are listed so that they are fetched first.
+        context_deps = [ctx.filename() for ctx in proj.context + task.context if ctx.context_type == LinkType.WEB_LINK]
+        task_deps = [done_alias(t) for t in proj.graph.reduced_dependencies(task)]
+        return context_deps + task_deps
+
+    for group in groups:
+        writer.build(
+            outputs=[task.filename() for task in group],
+            rule="create_prompt",
+            inputs=[task.section_filename() for task in group],
+            implicit=list(dict.fromkeys(dep for task in group for dep in prompt_deps(task))),
+            variables={"task": " ".join(task.slug() for task in group), "depfile": f"{group[0].filename()}.d"},
+        )
+        for task in group:
+            writer.build(
+                outputs=task.result_filename(),
+                rule="query",
+                inputs=task.filename(),
+                variables={"taskname": task.name},
+            )
+
+
+def done_alias(task: Task) -> str:
+    return task.path(f"done_{task.slug()}")
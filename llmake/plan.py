@@ -0,0 +1,232 @@
+import contextlib
+import heapq
+import io
+import statistics
+from dataclasses import dataclass
+from pathlib import Path
+
+from llmake import trace
+from llmake.files import FileRange
+from llmake.markdown import Project, Task
+from llmake.prompt import prompt_parts
+
+# Used when the build trace has no uncached query of the model to learn from.
+DEFAULT_OUTPUT_TOKENS = 500
+DEFAULT_TOKENS_PER_SECOND = 50.0
+
+
+@dataclass
+class TaskPlan:
+    task: Task
+    # "run" when the task would be queried, "cached" when the response cache already has the answer to its prompt,
+    # "fresh" when its result is up to date.
+    status: str
+    input_tokens: int
+    output_tokens: int
+    seconds: float
+    cost: float | None
+    # The prompt reads files that do not exist yet, web pages not fetched or results of tasks that would run, so
+    # input_tokens is a guess.
+    estimated: bool = False
+
+
+@dataclass
+class Plan:
+    tasks: list[TaskPlan]
+    # Tasks of the longest chain of dependencies, in build order, weighted by the seconds of the tasks that run.
+    critical_path: list[TaskPlan]
+    # Estimated time of the build with concurrency queries at once.
+    wall_seconds: float
+    concurrency: int
+
+    def running(self) -> list[TaskPlan]:
+        return [t for t in self.tasks if t.status == "run"]
+
+
+@dataclass
+class QueryHistory:
+    """What past uncached queries of a model in the build trace say about the next ones."""
+
+    # Completion tokens and seconds of the last query of each task, by task slug.
+    tasks: dict[str, tuple[int, float]]
+    output_tokens: int
+    tokens_per_second: float
+
+    @classmethod
+    def from_trace(cls, model: str, records: list[dict]) -> "QueryHistory":
+        queries = [
+            r
+            for r in records
+            if r.get("step") == "query"
+            and r.get("model") == model
+            and r.get("cache") == "miss"
+            and r.get("ok")
+            and r.get("completion_tokens")
+            and r.get("seconds", 0) > 0
+        ]
+        tasks = {r["task"]: (r["completion_tokens"], r["seconds"]) for r in queries if r.get("task")}
+        if not queries:
+            return cls(tasks, DEFAULT_OUTPUT_TOKENS, DEFAULT_TOKENS_PER_SECOND)
+        return cls(
+            tasks,
+            int(statistics.median(r["completion_tokens"] for r in queries)),
+            statistics.median(r["completion_tokens"] / r["seconds"] for r in queries),
+        )
+
+    def estimate(self, task: Task, output_tokens: int | None = None) -> tuple[int, float]:
+        """Completion tokens and seconds of a query of task. output_tokens overrides what the trace says."""
+        if output_tokens is None and task.slug() in self.tasks:
+            return self.tasks[task.slug()]
+        tokens = output_tokens if output_tokens is not None else self.output_tokens
+        return tokens, tokens / self.tokens_per_second
+
+
+def token_prices(model: str) -> tuple[float, float] | None:
+    """USD per input and per output token of model, None when litellm has no prices for it."""
+    from litellm import get_model_info
+
+    try:
+        # litellm prints a list of providers for models it does not know.
+        with contextlib.redirect_stdout(io.StringIO()):
+            info = get_model_info(model)
+    except Exception:
+        return None
+    return info.get("input_cost_per_token") or 0.0, info.get("output_cost_per_token") or 0.0
+
+
+def plan_project(
+    proj: Project,
+    model: str,
+    concurrency: int,
+    budget: int | None = None,
+    prefix_cache: bool = False,
+    chunks: int | None = None,
+    output_tokens: int | None = None,
+) -> Plan:
+    """Estimate what building proj would take, without querying or writing anything.
+
+    Prompts are assembled as create-prompt would, and compared to the prompt files already written: like a ninja
+    build, a task whose prompt did not change keeps its result. Results of tasks that would run are counted at their
+    estimated output tokens in the prompts of the tasks depending on them.
+    """
+    from litellm import token_counter
+
+    from llmake.cache import response_cache
+    from llmake.cli.query import prompt_messages
+
+    history = QueryHistory.from_trace(model, trace.load_trace())
+    cache = response_cache()
+    prices = token_prices(model)
+    counts: dict[Path | FileRange, int] = {}
+    plans: dict[str, TaskPlan] = {}
+
+    def cost(input_tokens: int, output_tokens: int) -> float | None:
+        return None if prices is None else input_tokens * prices[0] + output_tokens * prices[1]
+
+    def count(part: str | Path | FileRange) -> int:
+        if isinstance(part, str):
+            return token_counter(model=model, text=part)
+        if part not in counts:
+            counts[part] = token_counter(model=model, text=part.read_text())
+        return counts[part]
+
+    for level in proj.graph.levels():
+        for task in level:
+            tokens, seconds = history.estimate(task, output_tokens)
+            # Results that a query would rewrite, counted at the output tokens expected from their tasks.
+            pending = {
+                Path(t.result_filename()): history.estimate(t, output_tokens)[0]
+                for t in proj.get_dependent_tasks(task)
+                if plans[t.name].status != "fresh"
+            }
+            parts = prompt_parts(proj, task, None, model, prefix_cache, None)
+            missing = {part for part in parts if not isinstance(part, str) and not source_path(part).exists()}
+            if pending or missing:
+                # Web pages not fetched yet count for nothing.
+                input_tokens = sum(
+                    pending[part] if part in pending else 0 if part in missing else count(part) for part in parts
+                )
+                if budget is not None:
+                    input_tokens = min(input_tokens, budget)
+                plans[task.name] = TaskPlan(
+                    task, "run", input_tokens, tokens, seconds, cost(input_tokens, tokens), estimated=True
+                )
+                continue
+
+            parts = prompt_parts(proj, task, budget, model, prefix_cache, chunks)
+            prompt = "\n".join(part if isinstance(part, str) else part.read_text() for part in parts)
+            input_tokens = sum(count(part) for part in parts)
+            prompt_file, result = Path(task.filename()), Path(task.result_filename())
+            if (
+                result.exists()
+                and prompt_file.exists()
+                and result.stat().st_mtime >= prompt_file.stat().st_mtime
+                and prompt_file.read_text() == prompt
+            ):
+                plans[task.name] = TaskPlan(task, "fresh", input_tokens, 0, 0.0, 0.0)
+            elif cache and cache.has(cache.key(model, prompt_messages(prompt, model), {})):
+                plans[task.name] = TaskPlan(task, "cached", input_tokens, 0, 0.0, 0.0)
+            else:
+                plans[task.name] = TaskPlan(task, "run", input_tokens, tokens, seconds, cost(input_tokens, tokens))
+
+    tasks = [plans[task.name] for task in proj.tasks]
+    seconds = [t.seconds if t.status == "run" else 0.0 for t in tasks]
+    return Plan(
+        tasks, [tasks[i] for i in critical_path(proj, seconds)], schedule(proj, seconds, concurrency), concurrency
+    )
+
+
+def source_path(source: Path | FileRange) -> Path:
+    return source.path if isinstance(source, FileRange) else source
+
+
+def critical_path(proj: Project, seconds: list[float]) -> list[int]:
+    """Indices of the tasks of the chain of dependencies taking the most seconds, in build order."""
+    graph = proj.graph
+    total = [0.0] * len(proj.tasks)
+    previous: list[int | None] = [None] * len(proj.tasks)
+    for level in graph.levels():
+        for task in level:
+            i = graph.index[task.name]
+            longest = max(graph.deps[i], key=total.__getitem__, default=None)
+            previous[i] = longest
+            total[i] = seconds[i] + (total[longest] if longest is not None else 0.0)
+    if not total:
+        return []
+    path = []
+    i: int | None = max(range(len(total)), key=total.__getitem__)
+    while i is not None:
+        path.append(i)
+        i = previous[i]
+    return path[::-1]
+
+
+def schedule(proj: Project, seconds: list[float], concurrency: int) -> float:
+    """Seconds the build would take running at most concurrency tasks at once, each as soon as it can start."""
+    graph = proj.graph
+    dependents: list[list[int]] = [[] for _ in proj.tasks]
+    waiting = [len(deps) for deps in graph.deps]
+    for i, deps in enumerate(graph.deps):
+        for d in deps:
+            dependents[d].append(i)
+    ready_at = [0.0] * len(proj.tasks)
+    ready = [(0.0, i) for i, n in enumerate(waiting) if n == 0]
+    heapq.heapify(ready)
+    workers = [0.0] * max(concurrency, 1)
+    end = 0.0
+    while ready:
+        at, i = heapq.heappop(ready)
+        # Tasks that do not run take no worker.
+        if seconds[i]:
+            start = max(at, heapq.heappop(workers))
+            finish = start + seconds[i]
+            heapq.heappush(workers, finish)
+        else:
+            finish = at
+        end = max(end, finish)
+        for j in dependents[i]:
+            ready_at[j] = max(ready_at[j], finish)
+            waiting[j] -= 1
+            if waiting[j] == 0:
+                heapq.heappush(ready, (ready_at[j], j))
+    return end
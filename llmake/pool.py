@@ -0,0 +1,76 @@
+import contextlib
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from llmake.cache import cache_dir
+from llmake.naming import slugify
+
+DEFAULT_QUERY_DEPTH = 4
+DEFAULT_FETCH_DEPTH = 2
+
+
+def parse_pool(spec: str) -> tuple[str, int]:
+    """Parse NAME=DEPTH."""
+    name, _, depth = spec.rpartition("=")
+    if not name or not depth.isdigit() or int(depth) < 1:
+        raise ValueError(f"Invalid pool {spec!r}, expected NAME=DEPTH with a positive DEPTH")
+    return name, int(depth)
+
+
+@dataclass
+class Pools:
+    """How many LLM calls may run at once per model, and how many downloads per host.
+
+    overrides maps a model or a host name to its own depth.
+    """
+
+    query_depth: int = DEFAULT_QUERY_DEPTH
+    fetch_depth: int = DEFAULT_FETCH_DEPTH
+    overrides: dict[str, int] = field(default_factory=dict)
+
+    def query(self, model: str | None) -> tuple[str, int]:
+        model = model or ""
+        return f"llm_{slugify(model) or 'default'}", self.overrides.get(model, self.query_depth)
+
+    def fetch(self, url: str) -> tuple[str, int]:
+        host = urlsplit(url).hostname or ""
+        return f"web_{slugify(host) or 'default'}", self.overrides.get(host, self.fetch_depth)
+
+
+@contextlib.contextmanager
+def slot(name: str, depth: int, poll: float = 0.05) -> Iterator[None]:
+    """Hold one of the depth slots of the named pool, shared by every llmake process on this machine.
+
+    Slots are flock()ed files, so the slot of a process that dies is released with it. Without fcntl, as on
+    Windows, there is no limit.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+
+    directory = cache_dir() / "pools"
+    directory.mkdir(parents=True, exist_ok=True)
+    fd = _acquire(fcntl, directory, name, depth, poll)
+    try:
+        yield
+    finally:
+        os.close(fd)
+
+
+def _acquire(fcntl, directory: Path, name: str, depth: int, poll: float) -> int:
+    while True:
+        for i in range(depth):
+            fd = os.open(directory / f"{name}.{i}.lock", os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        time.sleep(poll)
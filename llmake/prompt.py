@@ -0,0 +1,219 @@
+import logging
+from dataclasses import dataclass
+from os import getenv
+from pathlib import Path
+
+import llmake.context as ctx
+from llmake.context import Context, LinkType
+from llmake.files import FileRange, write_parts
+from llmake.markdown import Project, Task
+
+
+@dataclass
+class Section:
+    name: str
+    # Files, or parts of files, the content of the section is copied from, and text to put in between.
+    sources: list[str | Path | FileRange]
+    # Sections with a lower priority are dropped first when the prompt exceeds its token budget.
+    priority: int
+
+    def text(self) -> str:
+        return "\n".join(s if isinstance(s, str) else s.read_text() for s in self.sources)
+
+
+# Trimming order, first dropped first: project contexts, task contexts, then results of previous tasks, those the
+# task depends on only indirectly before its direct dependencies. The project and task text are always kept. With the
+# prefix cache layout project contexts are always kept too, as they are part of the prefix shared by all tasks.
+PROJECT_CONTEXT, TASK_CONTEXT, INDIRECT_RESULT, DIRECT_RESULT, SHARED_CONTEXT = range(5)
+
+# Marks the end of the part of a prompt that is the same for every task of the project. query sends the text before
+# it as a separate block that providers can cache.
+CACHE_BREAKPOINT = "<!-- llmake:cache-breakpoint -->"
+
+# Stands for the chunks of a context left out of the prompt with retrieval.
+OMISSION = "[...]"
+
+
+def token_budget() -> int | None:
+    budget = getenv("LLMAKE_TOKEN_BUDGET")
+    return int(budget) if budget else None
+
+
+def unique_contexts(contexts: list[Context]) -> list[Context]:
+    """Drop repeated links to the same target, keeping the first one, and links to a part of a note included whole."""
+    whole = {c.target for c in contexts if c.context_type == LinkType.WIKI_LINK and not c.anchor()}
+    unique: dict[tuple[LinkType, str], Context] = {}
+    for c in contexts:
+        if c.context_type == LinkType.WIKI_LINK and c.anchor() and c.note() in whole:
+            continue
+        unique.setdefault((c.context_type, c.target), c)
+    return list(unique.values())
+
+
+def assemble_prompt(
+    doc: Project,
+    task: Task,
+    budget: int | None = None,
+    model: str | None = None,
+    prefix_cache: bool = False,
+    chunks: int | None = None,
+) -> str:
+    """Build the prompt of task.
+
+    With prefix_cache, the project text and the contexts linked from outside any task form a prefix that is
+    byte-identical across the prompts of the project, followed by CACHE_BREAKPOINT. With chunks, only that many
+    chunks of every context go in, those most relevant to the task text.
+    """
+    parts = prompt_parts(doc, task, budget, model, prefix_cache, chunks)
+    return "\n".join(part if isinstance(part, str) else part.read_text() for part in parts)
+
+
+def write_prompt(
+    doc: Project,
+    task: Task,
+    budget: int | None = None,
+    model: str | None = None,
+    prefix_cache: bool = False,
+    chunks: int | None = None,
+):
+    """Write the prompt of task to its file, like assemble_prompt but without holding it in memory.
+
+    Context files and results are copied into the prompt file by the kernel where the platform allows, and the file
+    is left untouched when the prompt did not change.
+    """
+    write_parts(Path(task.filename()), prompt_parts(doc, task, budget, model, prefix_cache, chunks))
+
+
+def prompt_inputs(doc: Project, task: Task) -> list[Path]:
+    """Files the prompt of task is copied from, those left out to fit a token budget included."""
+    sources = [context_source(c) for c in unique_contexts(doc.context + task.context)]
+    paths = [s.path if isinstance(s, FileRange) else s for s in sources if s]
+    return list(dict.fromkeys(paths + [Path(t.result_filename()) for t in doc.get_dependent_tasks(task)]))
+
+
+def prompt_parts(
+    doc: Project,
+    task: Task,
+    budget: int | None = None,
+    model: str | None = None,
+    prefix_cache: bool = False,
+    chunks: int | None = None,
+) -> list[str | Path | FileRange]:
+    """The prompt of task as lines of text and the files whose content goes in between, to be joined by newlines."""
+    task_targets = {(c.context_type, c.target) for c in task.context}
+    project_targets = {(c.context_type, c.target) for c in doc.context}
+    contexts = unique_contexts(doc.context + task.context)
+    direct = {t.name for t in doc.graph.reduced_dependencies(task)}
+
+    def priority(c: Context) -> int:
+        if prefix_cache and (c.context_type, c.target) in project_targets:
+            return SHARED_CONTEXT
+        return TASK_CONTEXT if (c.context_type, c.target) in task_targets else PROJECT_CONTEXT
+
+    def sources(c: Context) -> list[str | Path | FileRange]:
+        source = context_source(c)
+        if not source:
+            return []
+        if not chunks:
+            return [source]
+        from llmake.retrieval import relevant_chunks
+
+        parts: list[str | Path | FileRange] = []
+        # Shared contexts are picked for the project text, keeping the prefix the same for every task.
+        query = doc.prompt if priority(c) == SHARED_CONTEXT else task.prompt
+        for chunk in relevant_chunks(source, "\n".join(query), chunks):
+            parts += [OMISSION, chunk] if parts else [chunk]
+        return parts
+
+    context_sections = [Section(c.name, sources(c), priority(c)) for c in contexts]
+    result_sections = [
+        Section(t.name, [Path(t.result_filename())], DIRECT_RESULT if t.name in direct else INDIRECT_RESULT)
+        for t in doc.get_dependent_tasks(task)
+    ]
+
+    omitted: list[tuple[Section, int]] = []
+    if budget is not None:
+        context_sections, result_sections, omitted = fit_budget(
+            task.name, doc.prompt + task.prompt, context_sections, result_sections, budget, model
+        )
+
+    result: list[str | Path | FileRange] = list(doc.prompt)
+
+    def add(sections: list[Section]):
+        for section in sections:
+            result.append(f"## {section.name}")
+            result.extend(section.sources or [""])
+
+    result.append("# Contexts")
+    # unique_contexts keeps the first link to a target, so the shared project contexts always come first.
+    shared = sum(section.priority == SHARED_CONTEXT for section in context_sections)
+    add(context_sections[:shared])
+    if prefix_cache:
+        result.append(CACHE_BREAKPOINT)
+    add(context_sections[shared:])
+    result.append("# Previous Finished Tasks")
+    add(result_sections)
+    if omitted:
+        result.append("# Omitted To Fit The Token Budget")
+        result.extend(f"- {section.name} ({tokens} tokens)" for section, tokens in omitted)
+    result.append("# Task")
+    result.extend(task.prompt)
+    return result
+
+
+def fit_budget(
+    name: str,
+    fixed: list[str],
+    contexts: list[Section],
+    results: list[Section],
+    budget: int,
+    model: str | None,
+) -> tuple[list[Section], list[Section], list[tuple[Section, int]]]:
+    """Drop whole sections, lowest priority first, until the prompt of task name fits in budget tokens.
+
+    The project and task text, and the shared contexts, are always kept, with a warning when they alone do not fit.
+    """
+    from litellm import token_counter
+
+    def count(text: str) -> int:
+        return token_counter(model=model or "", text=text)
+
+    # Headings and the omitted list are small, counting the sections on their own is close enough.
+    used = count("\n".join(fixed))
+    # One section in memory at a time.
+    sizes = {id(s): count(f"## {s.name}\n{s.text()}") for s in contexts + results}
+    # Dropping shared contexts for some tasks only would give their prompts a different prefix.
+    shared = [s for s in contexts if s.priority == SHARED_CONTEXT]
+    used += sum(sizes[id(s)] for s in shared)
+    if used > budget:
+        kept = "project and task text, with the shared contexts," if shared else "project and task text"
+        logging.warning("The %s of %s take %d tokens, over the budget of %d", kept, name, used, budget)
+    used += sum(sizes[id(s)] for s in contexts + results if s.priority != SHARED_CONTEXT)
+
+    # Within a priority, contexts linked last and results of the oldest tasks go first.
+    candidates = [(s.priority, -i, s) for i, s in enumerate(contexts) if s.priority != SHARED_CONTEXT] + [
+        (s.priority, i, s) for i, s in enumerate(results)
+    ]
+    omitted = []
+    for _, _, section in sorted(candidates, key=lambda c: c[:2]):
+        if used <= budget:
+            break
+        omitted.append((section, sizes[id(section)]))
+        used -= sizes[id(section)]
+
+    dropped = {id(s) for s, _ in omitted}
+    return (
+        [s for s in contexts if id(s) not in dropped],
+        [s for s in results if id(s) not in dropped],
+        omitted,
+    )
+
+
+def context_source(context: Context) -> Path | FileRange | None:
+    """File, or part of a file, holding the content of context. None when there is none."""
+    match context.context_type:
+        case LinkType.WIKI_LINK:
+            return ctx.local_source(context.target, None)
+        case LinkType.WEB_LINK:
+            return Path(context.filename())
+    return None
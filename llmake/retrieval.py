@@ -0,0 +1,167 @@
+import hashlib
+import re
+import threading
+from dataclasses import dataclass
+from os import getenv
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from llmake.cache import cache_dir
+from llmake.files import FileRange, temp_path
+
+WORD = re.compile(r"\w+")
+# Chunks end at the first blank line after this many bytes, or at the first line break after twice as many.
+CHUNK_BYTES = 1500
+K1, B = 1.2, 0.75
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def retrieval_chunks() -> int | None:
+    """Number of chunks of each context to put in a prompt, from LLMAKE_RETRIEVAL_CHUNKS. None keeps contexts whole."""
+    chunks = getenv("LLMAKE_RETRIEVAL_CHUNKS")
+    return int(chunks) if chunks else None
+
+
+def split_chunks(data: bytes, size: int = CHUNK_BYTES) -> list[tuple[int, int]]:
+    """Byte ranges of the chunks of data, split between paragraphs where possible."""
+    chunks = []
+    start = offset = 0
+    for line in data.splitlines(keepends=True):
+        offset += len(line)
+        length = offset - start
+        if (length >= size and not line.strip()) or length >= 2 * size:
+            chunks.append((start, offset))
+            start = offset
+    if offset > start:
+        chunks.append((start, offset))
+    return chunks
+
+
+def terms(text: str) -> list[str]:
+    return WORD.findall(text.casefold())
+
+
+@dataclass
+class ChunkIndex:
+    """BM25 index over the chunks of one file, stored as flat NumPy arrays.
+
+    Chunk i holds the terms vocabulary[term_ids[indptr[i]:indptr[i + 1]]], each counts[...] times.
+    """
+
+    ranges: "np.ndarray"
+    vocabulary: dict[str, int]
+    indptr: "np.ndarray"
+    term_ids: "np.ndarray"
+    counts: "np.ndarray"
+
+    @classmethod
+    def build(cls, data: bytes) -> "ChunkIndex":
+        import numpy as np
+
+        ranges = split_chunks(data)
+        vocabulary: dict[str, int] = {}
+        indptr, term_ids, counts = [0], [], []
+        for start, end in ranges:
+            frequencies: dict[int, int] = {}
+            for term in terms(data[start:end].decode(errors="replace")):
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                frequencies[term_id] = frequencies.get(term_id, 0) + 1
+            term_ids += frequencies.keys()
+            counts += frequencies.values()
+            indptr.append(len(term_ids))
+        return cls(
+            np.array(ranges, dtype=np.int64).reshape(-1, 2),
+            vocabulary,
+            np.array(indptr, dtype=np.int64),
+            np.array(term_ids, dtype=np.int32),
+            np.array(counts, dtype=np.float32),
+        )
+
+    def scores(self, query: list[str]) -> "np.ndarray":
+        """BM25 score of every chunk for the query terms."""
+        import numpy as np
+
+        chunks = len(self.ranges)
+        wanted = np.array(sorted({self.vocabulary[t] for t in query if t in self.vocabulary}), dtype=np.int32)
+        if not chunks or not len(wanted):
+            return np.zeros(chunks)
+        chunk_of = np.repeat(np.arange(chunks), np.diff(self.indptr))
+        lengths = np.bincount(chunk_of, weights=self.counts, minlength=chunks)
+        hits = np.isin(self.term_ids, wanted)
+        documents = np.bincount(self.term_ids[hits], minlength=len(self.vocabulary))
+        idf = np.log1p((chunks - documents + 0.5) / (documents + 0.5))
+        tf = self.counts[hits]
+        norm = K1 * (1 - B + B * lengths[chunk_of[hits]] / max(lengths.mean(), 1))
+        weights = idf[self.term_ids[hits]] * tf * (K1 + 1) / (tf + norm)
+        return np.bincount(chunk_of[hits], weights=weights, minlength=chunks)
+
+    def top(self, query: list[str], k: int) -> list[tuple[int, int]]:
+        """Ranges of the k chunks scoring highest for query, in file order."""
+        import numpy as np
+
+        best = np.argsort(-self.scores(query), kind="stable")[:k]
+        return [tuple(map(int, self.ranges[i])) for i in sorted(best)]
+
+    def save(self, path: Path):
+        import numpy as np
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = temp_path(path)
+        with tmp.open("xb") as f:
+            np.savez(
+                f,
+                ranges=self.ranges,
+                # Terms are words, so they never contain a line break.
+                vocabulary=np.frombuffer("\n".join(self.vocabulary).encode(), dtype=np.uint8),
+                indptr=self.indptr,
+                term_ids=self.term_ids,
+                counts=self.counts,
+            )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ChunkIndex":
+        import numpy as np
+
+        with np.load(path) as data:
+            words = data["vocabulary"].tobytes().decode()
+            vocabulary = {term: i for i, term in enumerate(words.split("\n"))} if words else {}
+            return cls(data["ranges"], vocabulary, data["indptr"], data["term_ids"], data["counts"])
+
+
+_indexes: dict[tuple, tuple[list[int], ChunkIndex]] = {}
+_lock = threading.Lock()
+
+
+def chunk_index(source: Path | FileRange) -> ChunkIndex:
+    """Index of the content of source, cached on disk under its content hash, and in memory until the file changes."""
+    path = source.path if isinstance(source, FileRange) else source
+    stat = path.stat()
+    version = [stat.st_mtime_ns, stat.st_size]
+    key = (str(path.resolve()), source if isinstance(source, FileRange) else None)
+    with _lock:
+        cached = _indexes.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    data = source.read_bytes()
+    cache_file = cache_dir() / "retrieval" / f"{hashlib.sha256(data).hexdigest()}.npz"
+    try:
+        index = ChunkIndex.load(cache_file)
+    except (OSError, ValueError, KeyError):
+        index = ChunkIndex.build(data)
+        index.save(cache_file)
+    with _lock:
+        _indexes[key] = (version, index)
+    return index
+
+
+def relevant_chunks(source: Path | FileRange, query: str, k: int) -> list[Path | FileRange]:
+    """The k chunks of source most relevant to query, or source itself when it has no more than k chunks."""
+    index = chunk_index(source)
+    if len(index.ranges) <= k:
+        return [source]
+    path, offset = (source.path, source.start) if isinstance(source, FileRange) else (source, 0)
+    return [FileRange(path, offset + start, offset + end) for start, end in index.top(terms(query), k)]
@@ -0,0 +1,54 @@
+import random
+from pathlib import Path
+
+
+def synthetic_project(
+    tasks: int,
+    wiki_links: int = 1,
+    web_links: int = 1,
+    dependencies: float = 1.0,
+    section_lines: int = 20,
+    seed: int = 0,
+) -> str:
+    """Project markdown with the given number of tasks.
+
+    Each task links `wiki_links` notes and `web_links` pages, and depends on `dependencies` earlier tasks on
+    average, picked from the 50 tasks before it. Tasks after the first always name at least one dependency, as a
+    task without any depends on every task before it. Every section has `section_lines` lines of text.
+    """
+    rng = random.Random(seed)  # noqa: S311, reproducible, not security sensitive
+    docs = " and [the docs](https://example.com/docs)" if web_links else ""
+    lines = ["# Context", "", f"Shared notes in [[notes]]{docs}.", "", "# Tasks", ""]
+    for i in range(tasks):
+        lines += [f"## Task {i}", ""]
+        links = [f"[[note {i}-{j}]]" for j in range(wiki_links)]
+        links += [f"[page {i}-{j}](https://example.com/{i}/{j})" for j in range(web_links)]
+        if i:
+            window = range(max(0, i - 50), i)
+            count = min(len(window), max(1, int(dependencies) + (rng.random() < dependencies % 1)))
+            links += [f"[[#Task {d}]]" for d in sorted(rng.sample(window, count))]
+        if links:
+            lines.append(f"Use {', '.join(links)}.")
+        lines += [f"Line {j} of task {i}, with some *emphasis* and `code`." for j in range(section_lines)]
+        lines.append("")
+    return "\n".join(lines)
+
+
+def write_project(directory: Path, tasks: int, results: bool = True, **options) -> Path:
+    """Write a synthetic project and every file its prompts read, as if all tasks had already run.
+
+    Without results, only the contexts are written, leaving every task to build. Returns the path of the project file.
+    """
+    from llmake.context import LinkType
+    from llmake.markdown import parse_markdown
+
+    markdown = synthetic_project(tasks, **options)
+    proj = parse_markdown(markdown)
+    for context in proj.context + [c for task in proj.tasks for c in task.context]:
+        if context.context_type != LinkType.HEAD_LINK:
+            (directory / context.filename()).write_text(f"Content of {context.target}.\n" * 20)
+    for task in proj.tasks if results else []:
+        (directory / task.result_filename()).write_text(f"Result of {task.name}.\n" * 20)
+    path = directory / "project.md"
+    path.write_text(markdown)
+    return path
@@ -0,0 +1,163 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextvars import ContextVar
+from os import getenv
+from pathlib import Path
+
+from llmake.cache import cache_dir
+
+_current: ContextVar[dict | None] = ContextVar("llmake_trace_step", default=None)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def trace_path() -> Path:
+    return cache_dir() / "trace.jsonl"
+
+
+def previous_path(path: Path) -> Path:
+    """Where the trace at path goes once it grows past its size limit, replacing the one before."""
+    return path.with_suffix(".1.jsonl")
+
+
+def max_bytes() -> int:
+    return int(getenv("LLMAKE_TRACE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def append_record(record: dict, path: Path | None = None):
+    """Append record as one line. A single O_APPEND write keeps lines of concurrent processes whole.
+
+    A trace growing past LLMAKE_TRACE_MAX_BYTES moves to previous_path, so at most two of them are kept.
+    """
+    path = path or trace_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_CREAT | os.O_APPEND | os.O_WRONLY)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode())
+        size = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    if size > max_bytes():
+        # Another process may have just moved it, leaving a new trace that must not replace the previous one.
+        with contextlib.suppress(FileNotFoundError):
+            if path.stat().st_size > max_bytes():
+                path.replace(previous_path(path))
+
+
+def peak_rss_kb() -> int | None:
+    """Peak resident set size of the whole process so far, not only of the running step."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+@contextlib.contextmanager
+def step(name: str, **fields) -> Iterator[dict]:
+    """Trace one build step, appending its record to the trace once it finishes.
+
+    Code running inside the step adds to the record with annotate, such as the token usage of a query.
+    """
+    record = {"step": name, **fields}
+    token = _current.set(record)
+    start, wall_start = time.perf_counter(), time.time()
+    ok = False
+    try:
+        yield record
+        ok = True
+    finally:
+        _current.reset(token)
+        record.update(
+            start=wall_start,
+            seconds=time.perf_counter() - start,
+            process_max_rss_kb=peak_rss_kb(),
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+            ok=ok,
+        )
+        append_record(record)
+
+
+def annotate(**fields):
+    """Add fields to the record of the innermost running step, if any."""
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+
+def load_trace(path: Path | None = None, tail: int | None = None) -> list[dict]:
+    """Records of the trace and the one before it, or with tail only those in their last tail bytes."""
+    path = path or trace_path()
+    lines, size = _read_lines(path, tail)
+    if tail is None or size < tail:
+        lines = _read_lines(previous_path(path), None if tail is None else tail - size)[0] + lines
+    records = []
+    for line in lines:
+        # A crashed writer may leave a partial last line behind.
+        with contextlib.suppress(ValueError):
+            records.append(json.loads(line))
+    return records
+
+
+def _read_lines(path: Path, tail: int | None) -> tuple[list[str], int]:
+    """Lines of path, or those in its last tail bytes, and the size of path."""
+    try:
+        with path.open("rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            if f.seek(max(size - tail, 0) if tail is not None else 0):
+                # Skip the line cut in half.
+                f.readline()
+            return f.read().decode().splitlines(), size
+    except FileNotFoundError:
+        return [], 0
+
+
+SUMMED = ("seconds", "prompt_tokens", "cached_tokens", "completion_tokens", "cost")
+
+
+def summarize(records: list[dict], key: str) -> dict[str, dict]:
+    """Totals of the records grouped by key: steps, failures, cache hits, hedges, time, tokens and cost."""
+    groups: dict[str, dict] = {}
+    for record in records:
+        group = groups.setdefault(
+            str(record.get(key) or "-"),
+            {"steps": 0, "failed": 0, "cache_hits": 0, "hedges": 0, "hedge_wins": 0, "process_max_rss_kb": 0}
+            | dict.fromkeys(SUMMED, 0),
+        )
+        group["steps"] += 1
+        group["failed"] += not record.get("ok", True)
+        group["cache_hits"] += record.get("cache") == "hit"
+        group["hedges"] += bool(record.get("hedged"))
+        group["hedge_wins"] += bool(record.get("hedge_won"))
+        group["process_max_rss_kb"] = max(group["process_max_rss_kb"], record.get("process_max_rss_kb") or 0)
+        for field in SUMMED:
+            group[field] += record.get(field) or 0
+    return groups
+
+
+def chrome_trace(records: list[dict]) -> dict:
+    """Records as Chrome trace events, viewable in chrome://tracing or Perfetto."""
+    events = []
+    for record in records:
+        args = {k: v for k, v in record.items() if k not in ("step", "start", "seconds", "pid", "tid")}
+        events.append(
+            {
+                "name": f"{record['step']} {record.get('task') or ''}".strip(),
+                "cat": record["step"],
+                "ph": "X",
+                "ts": int(record["start"] * 1e6),
+                "dur": int(record["seconds"] * 1e6),
+                "pid": record.get("pid", 0),
+                "tid": record.get("tid", 0),
+                "args": args,
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,99 @@
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from llmake.context import LinkType, resolve_local_file
+from llmake.markdown import Project, Task, load_project
+
+Snapshot = dict[Path, tuple[int, int] | None]
+
+
+def stat_files(paths) -> Snapshot:
+    """Modification time and size of every path, None for missing files."""
+    snapshot: Snapshot = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            snapshot[path] = None
+    return snapshot
+
+
+def context_readers(proj: Project) -> dict[Path, set[str]]:
+    """The context files the prompts of proj read, with the names of the tasks reading them.
+
+    Files linked from outside any task are read by every task. Wiki links also map the note they resolve to, which
+    may live elsewhere in the vault.
+    """
+    readers: dict[Path, set[str]] = {}
+    every = {task.name for task in proj.tasks}
+    links = [(c, every) for c in proj.context] + [(c, {task.name}) for task in proj.tasks for c in task.context]
+    for context, names in links:
+        if context.context_type == LinkType.HEAD_LINK:
+            continue
+        paths = [Path(context.filename())]
+        if context.context_type == LinkType.WIKI_LINK:
+            paths.append(resolve_local_file(context.note(), None) or paths[0])
+        for path in paths:
+            readers.setdefault(path, set()).update(names)
+    return readers
+
+
+def affected_tasks(proj: Project, digests: dict[str, str], readers: dict[Path, set[str]], changed) -> list[Task]:
+    """Tasks to rebuild after the files in changed changed, in project order.
+
+    Those are the tasks whose section of the project file no longer matches digests, those reading a changed file,
+    and every task depending on one of them.
+    """
+    dirty = {task.name for task in proj.tasks if digests.get(task.name) != proj.section_digest(task)}
+    for path in changed:
+        dirty |= readers.get(path, set())
+    affected = []
+    for level in proj.levels():
+        for task in level:
+            if task.name in dirty or any(t.name in dirty for t in proj.get_dependent_tasks(task)):
+                dirty.add(task.name)
+                affected.append(task)
+    order = {task.name: i for i, task in enumerate(proj.tasks)}
+    return sorted(affected, key=lambda task: order[task.name])
+
+
+def watch(
+    projfile: str,
+    build: Callable[[Project, list[Task]], None],
+    interval: float = 0.5,
+    debounce: float = 0.3,
+):
+    """Build every task of projfile, then rebuild the tasks affected by every change until interrupted.
+
+    The project file and the files its prompts read are polled every interval seconds. A rebuild starts once none
+    of them changed for debounce seconds.
+    """
+    proj = load_project(projfile)
+    build(proj, proj.tasks)
+    while True:
+        readers = context_readers(proj)
+        digests = {task.name: proj.section_digest(task) for task in proj.tasks}
+        # Taken after the build, so the files it wrote itself do not count as changes.
+        before = stat_files([Path(projfile), *readers])
+        now = before
+        while now == before:
+            time.sleep(interval)
+            now = stat_files(before)
+        settled = None
+        while settled != now:
+            settled = now
+            time.sleep(debounce)
+            now = stat_files(before)
+
+        changed = {path for path in now if now[path] != before[path]}
+        try:
+            edited = load_project(projfile)
+            tasks = affected_tasks(edited, digests, readers, changed)
+        except (OSError, ValueError) as e:
+            # Saved halfway through an edit, wait for the next save.
+            print(e)
+            continue
+        proj = edited
+        build(proj, tasks)
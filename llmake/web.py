@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from llmake.cache import atomic_write, cache_dir
+
+
+@dataclass
+class Page:
+    url: str
+    html: str
+    etag: str | None = None
+    last_modified: str | None = None
+    # Extracted article text and the digest of the html it was extracted from.
+    text: str | None = None
+    html_digest: str | None = None
+
+
+class WebCache:
+    """Downloaded pages and their extracted text, revalidated with ETag and Last-Modified."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def _path(self, url: str) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def get(self, url: str) -> Page | None:
+        try:
+            return Page(**json.loads(self._path(url).read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def put(self, page: Page):
+        atomic_write(self._path(page.url), json.dumps(asdict(page)))
+
+
+def web_cache() -> WebCache:
+    return WebCache(cache_dir() / "web")
+
+
+def extract_article(url: str, html: str) -> str | None:
+    import newspaper
+
+    try:
+        return newspaper.Article(url).download(input_html=html).parse().text
+    except newspaper.ArticleException as e:
+        logging.info("Failed to extract article %s: %s", url, e)
+        return None
+
+
+def _digest(html: str) -> str:
+    return hashlib.sha256(html.encode()).hexdigest()
+
+
+def download(session, url: str, cached: Page | None, timeout: float = 30) -> Page | None:
+    """Fetch url, sending a conditional request when an earlier copy is cached.
+
+    The cached copy stands in for the page when the server is down, times out or answers with a server error. A
+    page that is gone or refused, a 4xx, fails the fetch.
+    """
+    import requests
+
+    headers = {}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+    try:
+        response = session.get(url, headers=headers, timeout=timeout)
+        if cached and response.status_code == 304:
+            return cached
+        response.raise_for_status()
+    except (requests.ConnectionError, requests.Timeout) as e:
+        return _fall_back(url, cached, e)
+    except requests.HTTPError as e:
+        if response.status_code >= 500:
+            return _fall_back(url, cached, e)
+        logging.warning("Failed to fetch %s: %s", url, e)
+        return None
+    except requests.RequestException as e:
+        logging.warning("Failed to fetch %s: %s", url, e)
+        return None
+    return Page(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+
+def _fall_back(url: str, cached: Page | None, error: Exception) -> Page | None:
+    if cached:
+        logging.warning("Failed to fetch %s, using the copy cached earlier: %s", url, error)
+    else:
+        logging.warning("Failed to fetch %s: %s", url, error)
+    return cached
+
+
+def fetch_pages(
+    urls: list[str],
+    max_workers: int = 8,
+    extractor: Callable[[str, str], str | None] = extract_article,
+    cache: WebCache | None = None,
+) -> dict[str, str | None]:
+    """Fetch the article text of every url.
+
+    Downloads share one pool of keep-alive connections and run on threads, while the CPU heavy extraction
+    runs in a process pool, skipped for pages whose html did not change since the last extraction. The extractor
+    must be a module level function so that it can be sent to the worker processes.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    cache = cache or web_cache()
+    urls = list(dict.fromkeys(urls))
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    with session, ThreadPoolExecutor(max_workers) as threads:
+        pages = list(threads.map(lambda url: download(session, url, cache.get(url)), urls))
+
+    stale = [page for page in pages if page and (page.text is None or page.html_digest != _digest(page.html))]
+    if len(stale) > 1:
+        with ProcessPoolExecutor(min(max_workers, len(stale))) as processes:
+            texts = list(processes.map(extractor, [p.url for p in stale], [p.html for p in stale]))
+    else:
+        # Not worth starting worker processes for a single page.
+        texts = [extractor(p.url, p.html) for p in stale]
+    for page, text in zip(stale, texts):
+        page.text, page.html_digest = text, _digest(page.html)
+        cache.put(page)
+
+    return {url: page.text if page else None for url, page in zip(urls, pages)}
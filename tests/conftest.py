@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in tmp_path, with the llmake cache under it."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LLMAKE_CACHE_DIR", str(tmp_path / ".llmake"))
+    return tmp_path
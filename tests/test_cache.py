@@ -0,0 +1,81 @@
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from llmake.cache import ResponseCache
+
+
+def test_get_or_compute_coalesces_identical_requests(tmp_path):
+    cache = ResponseCache(tmp_path)
+    key = cache.key("model", [{"role": "user", "content": "hi"}], {})
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "hello", True
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(key, compute))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(results) == [("hello", False)] + [("hello", True)] * 3
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10)
+    cache.put("aa1", "123")
+    os.utime(tmp_path / "aa" / "aa1", (0, 0))
+    cache.put("bb1", "123")
+    cache.put("cc1", "123")
+    cache.put("dd1", "123")
+
+    assert cache.get("aa1") is None
+    assert cache.get("bb1") == "123"
+    assert cache.get("cc1") == "123"
+    assert cache.get("dd1") == "123"
+
+
+def test_store_is_only_scanned_once_full(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path, max_bytes=100)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+    for key in ["aa1", "bb1", "cc1", "dd1"]:
+        cache.put(key, "x" * 30)
+    # The first write counts the store, the fourth takes it past max_bytes.
+    assert len(scans) == 2
+    assert cache.stats()["bytes"] == 90
+
+
+def test_lock_of_a_finished_process_is_taken_over(tmp_path):
+    cache = ResponseCache(tmp_path)
+    key = cache.key("model", [], {})
+    assert cache._try_lock(key)
+    assert not cache._try_lock(key)
+
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])  # noqa: S603
+    finished.wait()
+    cache._lock(key).write_text(f"{platform.node()} {finished.pid}")
+    assert not cache._try_lock(key)
+    assert cache._try_lock(key)
+
+
+def test_stats_log_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr("llmake.cache.STATS_COMPACT_BYTES", 10)
+    cache = ResponseCache(tmp_path)
+    for event in "hhmhhhmhhhmhh":
+        cache._count("hit" if event == "h" else "miss")
+
+    assert (tmp_path / "stats").stat().st_size <= 10
+    assert cache.stats()["hits"] == 10
+    assert cache.stats()["misses"] == 3
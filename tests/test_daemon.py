@@ -0,0 +1,63 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from llmake import client
+
+PROJECT = "# Tasks\n\n## First\n\nWrite something.\n"
+
+
+@pytest.fixture
+def daemon_env(workdir, monkeypatch):
+    # Long enough for the commands of a test, short enough to see the daemon go.
+    monkeypatch.setenv("LLMAKE_DAEMON_IDLE_TIMEOUT", "3")
+    (workdir / "project.md").write_text(PROJECT)
+    return workdir
+
+
+def run_client(argv: list[str]) -> int:
+    with pytest.raises(SystemExit) as exit_info:
+        client.main(argv)
+    return exit_info.value.code  # type: ignore [reportReturnType]
+
+
+def test_daemon_runs_commands_until_idle(daemon_env, capsys):
+    assert run_client(["hash-sections", "project.md"]) == 0
+    assert (daemon_env / "section_first.hash").exists()
+    path = client.socket_path()
+    assert path.exists()
+
+    assert run_client(["create-prompt", "project.md", "missing"]) == -1
+    assert "Cannot find task missing" in capsys.readouterr().out
+
+    other = daemon_env / "other"
+    other.mkdir()
+    with pytest.MonkeyPatch.context() as m:
+        m.chdir(other)
+        assert run_client(["hash-sections", "project.md"]) == -1
+    assert f"llmake daemon serves {daemon_env}, not {other}" in capsys.readouterr().out
+
+    deadline = time.monotonic() + 15
+    while path.exists() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert not path.exists()
+
+
+def test_client_reports_daemon_dying_mid_request(daemon_env, monkeypatch, capsys):
+    path = daemon_env / "dying.sock"
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen()
+
+    def answer_nothing():
+        conn, _ = server.accept()
+        conn.makefile("rb").readline()
+        conn.close()
+
+    threading.Thread(target=answer_nothing, daemon=True).start()
+    monkeypatch.setattr(client, "socket_path", lambda: path)
+    assert run_client(["hash-sections", "project.md"]) == -1
+    assert "llmake daemon exited without answering" in capsys.readouterr().err
+    server.close()
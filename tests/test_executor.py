@@ -0,0 +1,35 @@
+import threading
+
+from llmake.executor import Job, run_jobs
+
+
+def test_run_jobs_respects_dependencies():
+    order = []
+    lock = threading.Lock()
+
+    def record(name):
+        def fn():
+            with lock:
+                order.append(name)
+
+        return fn
+
+    jobs = [
+        Job("c", record("c"), ["a", "b"]),
+        Job("a", record("a")),
+        Job("b", record("b"), ["a"]),
+    ]
+    assert run_jobs(jobs, 4) == {}
+    assert order == ["a", "b", "c"]
+
+
+def test_run_jobs_skips_dependents_of_failures():
+    ran = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    jobs = [Job("a", fail), Job("b", lambda: ran.append("b"), ["a"]), Job("c", lambda: ran.append("c"))]
+    failures = run_jobs(jobs, 2)
+    assert list(failures) == ["a"]
+    assert ran == ["c"]
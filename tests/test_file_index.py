@@ -0,0 +1,56 @@
+import pytest
+
+from llmake.file_index import FileIndex
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLMAKE_CACHE_DIR", str(tmp_path / "cache"))
+    root = tmp_path / "vault"
+    (root / "notes" / "deep").mkdir(parents=True)
+    (root / ".git").mkdir()
+    (root / ".git" / "llmake.md").write_text("hidden")
+    (root / "notes" / "llmake notes.md").write_text("notes")
+    (root / "notes" / "deep" / "llmake.md").write_text("exact")
+    return root
+
+
+def test_resolve_prefers_exact_match(vault):
+    index = FileIndex(vault)
+    index.load()
+    assert index.resolve("llmake") == vault / "notes" / "deep" / "llmake.md"
+    assert index.resolve("llmake n") == vault / "notes" / "llmake notes.md"
+    assert index.resolve("missing") is None
+
+
+def test_refresh_picks_up_new_and_removed_files(vault):
+    index = FileIndex(vault)
+    index.load()
+    (vault / "notes" / "deep" / "llmake.md").unlink()
+    (vault / "new").mkdir()
+    (vault / "new" / "jj.md").write_text("jj")
+
+    reloaded = FileIndex(vault)
+    reloaded.load()
+    assert reloaded.resolve("jj") == vault / "new" / "jj.md"
+    assert reloaded.resolve("llmake") == vault / "notes" / "llmake notes.md"
+
+
+def test_build_outputs_do_not_rewrite_the_index(vault, monkeypatch):
+    builds = []
+    build_table = FileIndex._build_table
+    monkeypatch.setattr(FileIndex, "_build_table", lambda self: builds.append(1) or build_table(self))
+    index = FileIndex(vault)
+    index.load()
+    assert len(builds) == 1
+
+    saved = index.cache_file().stat().st_mtime_ns
+    (vault / "prompt_a.stamp").write_text("")
+    (vault / "section_a.hash").write_text("")
+    tmp = vault / "notes" / ".llmake notes.md.tmp"
+    tmp.write_text("rewritten")
+    tmp.replace(vault / "notes" / "llmake notes.md")
+    assert not index.refresh()
+    assert index.cache_file().stat().st_mtime_ns == saved
+    assert index.resolve("prompt_a") is None
+    assert len(builds) == 1
@@ -0,0 +1,174 @@
+import shutil
+import subprocess
+import sys
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from llmake.makefile import CLEAN_CHUNK, create_makefile
+from llmake.markdown import load_projects, parse_markdown
+from llmake.ninja import create_ninja_file, write_ninja_file, write_projects_ninja_file
+from llmake.pool import Pools
+from llmake.synth import synthetic_project
+
+
+def test_clean_rule_is_split_into_short_commands():
+    makefile = create_makefile("project.md", parse_markdown(synthetic_project(300)))
+
+    removes = [line for line in makefile.splitlines() if line.startswith("\t@rm -f ")]
+    assert len(removes) > 1
+    assert all(line.count('" "') < CLEAN_CHUNK for line in removes)
+
+
+def test_ninja_shards_are_only_rewritten_when_changed(workdir, monkeypatch):
+    # A relative cache directory keeps the subninja paths short.
+    monkeypatch.setenv("LLMAKE_CACHE_DIR", ".llmake")
+
+    def generate(markdown):
+        out = StringIO()
+        write_ninja_file(out, "project.md", parse_markdown(markdown), shard_size=10)
+        return out.getvalue()
+
+    root = generate(synthetic_project(25, section_lines=1))
+    shards = sorted((workdir / ".llmake" / "ninja").glob("project.*.ninja"))
+    assert [line for line in root.splitlines() if line.startswith("subninja ")] == [
+        f"subninja .llmake/ninja/project.{i}.ninja" for i in range(3)
+    ]
+    assert "rule query" in root
+    assert "build result_task-24.md" in shards[2].read_text()
+
+    mtimes = [shard.stat().st_mtime_ns for shard in shards]
+    edited = synthetic_project(25, section_lines=1).replace("[page 24-0]", "[page 24-1]")
+    generate(edited)
+    assert [shard.stat().st_mtime_ns for shard in shards][:2] == mtimes[:2]
+    assert "context_page-24-1.md" in shards[2].read_text()
+
+    generate(synthetic_project(15, section_lines=1))
+    assert sorted(p.name for p in shards[0].parent.iterdir()) == ["project.0.ninja", "project.1.ninja"]
+
+
+def test_llm_and_web_steps_run_in_pools(monkeypatch):
+    monkeypatch.setenv("MODEL", "gpt-4o")
+    proj = parse_markdown(synthetic_project(3))
+    pools = Pools(3, 1, {"example.com": 2})
+
+    ninja = create_ninja_file("project.md", proj, pools=pools)
+    assert "pool llm_gpt-4o\n  depth = 3\n" in ninja
+    assert "pool web_example-com\n  depth = 2\n" in ninja
+    assert ninja.count("  pool = web_example-com\n") == 4
+    assert "  pool = llm_gpt-4o\n" in ninja
+
+    makefile = create_makefile("project.md", proj, pools=pools)
+    assert makefile.count("llmake query --pool llm_gpt-4o=3 ") == 3
+    assert makefile.count("llmake fetch-context --pool web_example-com=2 ") == 4
+
+
+def test_projects_share_one_fetch_of_each_page(workdir):
+    for name in ["alpha", "beta"]:
+        (workdir / f"{name}.md").write_text(
+            f"# Tasks\n\n## Summary\n\nSummarize [the page](https://example.com/{name}) and [this](https://example.com/shared).\n"
+        )
+    files = ["alpha.md", "beta.md"]
+    projects = dict(zip(files, load_projects(files, "build")))
+
+    out = StringIO()
+    write_projects_ninja_file(out, projects, "build")
+    root = out.getvalue()
+    assert root.count("build build/contexts/context_https-example-com-shared-") == 1
+    assert root.count("rule fetch\n") == 1
+    assert "subninja build/projects/alpha/build.ninja" in root
+    assert "--out-dir build" in root
+
+    beta = (workdir / "build" / "projects" / "beta" / "build.ninja").read_text()
+    assert "projfile = beta.md" in beta
+    assert "build build/projects/beta/result_summary.md:" in beta
+    assert "build/projects/beta/done_summary" in beta
+
+
+def test_notes_are_left_to_depfiles():
+    proj = parse_markdown(
+        "# Context\n\nSee [[notes]] and [[#A]].\n\n# Tasks\n\n## A\n\nRead [the page](https://example.com).\n"
+    )
+
+    ninja = create_ninja_file("project.md", proj)
+    assert (
+        "build task_a.md: create_prompt section_a.hash | context_the-page.md\n  task = a\n  depfile = task_a.md.d\n"
+        in ninja
+    )
+    assert "notes.md" not in ninja and " .md" not in ninja
+
+    makefile = create_makefile("project.md", proj)
+    assert "prompt_a.stamp: section_a.hash context_the-page.md\n" in makefile
+    assert "--depfile prompt_a.d --depfile-target prompt_a.stamp" in makefile
+    assert makefile.endswith("\n-include prompt_a.d\n")
+
+
+BATCHED = """# Context
+
+Shared.
+
+# Tasks
+
+## A
+
+Do a.
+
+## B
+
+Do b, see [[#Context]].
+
+## C
+
+Use [[#A]] and [[#B]].
+"""
+
+
+@pytest.mark.parametrize("builder", ["make", "ninja"])
+def test_batched_prompts_of_a_level_are_written_by_one_call(workdir, builder):
+    if not shutil.which(builder):
+        pytest.skip(f"{builder} is not installed")
+    Path("project.md").write_text(BATCHED)
+    proj = parse_markdown(BATCHED)
+    assert [[t.name for t in level] for level in proj.levels()] == [["A", "B"], ["C"]]
+    command = f"{sys.executable} -m llmake"
+    if builder == "ninja":
+        Path("build.ninja").write_text(create_ninja_file("project.md", proj, command, batch=True))
+    else:
+        Path("makefile").write_text(create_makefile("project.md", proj, command, batch=True))
+
+    def build() -> list[str]:
+        """Lines of the build output announcing a create-prompt call."""
+        args = [builder, "--no-print-directory"] if builder == "make" else [builder]
+        argv = [*args, "task_a.md", "task_b.md"]
+        out = subprocess.run(argv, check=True, capture_output=True, text=True).stdout  # noqa: S603
+        return [line for line in out.splitlines() if "prompt file" in line]
+
+    assert len(build()) == 1
+    assert "Do a." in Path("task_a.md").read_text()
+    assert "Do b, see" in Path("task_b.md").read_text()
+
+    # The batch runs again for the edited task, and only rewrites the prompt that changed.
+    mtime = Path("task_a.md").stat().st_mtime_ns
+    Path("project.md").write_text(BATCHED.replace("Do b,", "Do b now,"))
+    assert len(build()) == 1
+    assert Path("task_a.md").stat().st_mtime_ns == mtime
+    assert "Do b now," in Path("task_b.md").read_text()
+
+    # The stamps are up to date, nothing runs again.
+    assert build() == []
+
+
+def test_make_fetches_all_pages_once_through_a_stamp(workdir):
+    if not shutil.which("make"):
+        pytest.skip("make is not installed")
+    proj = parse_markdown("# Tasks\n\n## A\n\nRead [a](https://a.example) and [b](https://b.example).\n")
+    makefile = create_makefile("project.md", proj, "./fetch", fetch_all=True)
+    assert "&:" not in makefile
+    Path("makefile").write_text(makefile)
+    Path("fetch").write_text("#!/bin/sh\necho fetched >> fetches\ntouch context_a.md context_b.md\n")
+    Path("fetch").chmod(0o755)
+
+    for _ in range(2):
+        subprocess.run(["make", "-j2", "context_a.md", "context_b.md"], check=True, capture_output=True)  # noqa: S603, S607
+    assert Path("fetches").read_text() == "fetched\n"
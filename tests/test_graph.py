@@ -0,0 +1,49 @@
+from pathlib import Path
+
+import pytest
+
+from llmake.graph import CycleError, TaskGraph
+from llmake.markdown import Task
+
+
+def make_tasks(deps: dict[str, list[str]]) -> list[Task]:
+    return [Task(name, [], [], dependency) for name, dependency in deps.items()]
+
+
+def test_levels_and_reduction():
+    tasks = make_tasks({"a": [], "b": ["a"], "c": ["a"], "d": ["a", "b", "c", "missing"]})
+    graph = TaskGraph(tasks)
+
+    assert [[t.name for t in level] for level in graph.levels()] == [["a"], ["b", "c"], ["d"]]
+    assert [t.name for t in graph.dependencies(tasks[3])] == ["a", "b", "c"]
+    assert [t.name for t in graph.reduced_dependencies(tasks[3])] == ["b", "c"]
+
+
+def test_chain_of_implicit_dependencies_reduces_to_previous_task():
+    names = [f"t{i}" for i in range(50)]
+    graph = TaskGraph(make_tasks({name: names[:i] for i, name in enumerate(names)}))
+
+    assert all(
+        [t.name for t in graph.reduced_dependencies(task)] == names[i - 1 : i] for i, task in enumerate(graph.tasks)
+    )
+
+
+def test_cycle_is_reported():
+    graph = TaskGraph(make_tasks({"a": ["c"], "b": ["a"], "c": ["b"], "d": []}))
+
+    with pytest.raises(CycleError, match="a -> c -> b -> a"):
+        graph.levels()
+
+
+@pytest.mark.parametrize("command", [[], ["run"], ["create-prompt", "--all"], ["plan"]])
+def test_cycle_exits_with_an_error(workdir, monkeypatch, capsys, command):
+    from llmake.cli.main import app
+
+    monkeypatch.setenv("MODEL", "mock/latency=0")
+    Path("p.md").write_text("# Tasks\n\n## A\n\nDo a after [[#B]].\n\n## B\n\nDo b after [[#A]].\n")
+
+    with pytest.raises(SystemExit) as exit_info:
+        app([*command[:1], "p.md", *command[1:]])
+    assert exit_info.value.code == -1
+    assert "Circular task dependency: A -> B -> A" in capsys.readouterr().out
+    assert not Path("makefile").exists()
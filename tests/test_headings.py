@@ -0,0 +1,66 @@
+from llmake.context import Context, LinkType
+from llmake.files import FileRange, write_parts
+from llmake.headings import build_index, note_index
+from llmake.prompt import context_source
+
+NOTE = """Intro paragraph.
+
+# Setup
+
+Install it. ^install
+
+## Linux
+
+Use apt.
+
+```sh
+# not a heading
+```
+
+## macOS
+
+- use brew ^brew
+- or ports
+
+# Usage
+
+| a | b |
+| - | - |
+
+^table
+"""
+
+
+def section(anchor: str) -> str | None:
+    data = NOTE.encode()
+    found = build_index(data).find(anchor)
+    return data[found[0] : found[1]].decode() if found else None
+
+
+def test_heading_subtrees():
+    assert section("Setup").startswith("# Setup\n")
+    assert section("Setup").endswith("- or ports\n\n")
+    assert section("linux") == "## Linux\n\nUse apt.\n\n```sh\n# not a heading\n```\n\n"
+    assert section("Setup#macOS").startswith("## macOS")
+    assert section("Usage#macOS") is None
+    assert section("Missing") is None
+
+
+def test_block_references():
+    assert section("^install") == "Install it. ^install\n"
+    assert section("^brew") == "- use brew ^brew\n"
+    assert section("^table") == "| a | b |\n| - | - |\n"
+
+
+def test_wiki_link_to_heading_copies_only_that_section(workdir):
+    (workdir / "guide.md").write_text(NOTE)
+
+    source = context_source(Context(LinkType.WIKI_LINK, "guide#Linux", "guide#Linux"))
+    assert isinstance(source, FileRange)
+    assert source.read_text() == section("Linux")
+    write_parts(workdir / "out.md", ["before", source, "after"])
+    assert (workdir / "out.md").read_text() == f"before\n{section('Linux')}\nafter"
+
+    # The second lookup is served from the index cached on disk.
+    assert list((workdir / ".llmake" / "headings").glob("*.json"))
+    assert note_index(workdir / "guide.md") is note_index(workdir / "guide.md")
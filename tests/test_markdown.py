@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from llmake.context import Context, LinkType
+from llmake.markdown import parse_markdown
+
+TEST_PROJECT = (Path(__file__).parent / "test.md").read_text()
+
+
+def test_parse_markdown():
+    proj = parse_markdown(TEST_PROJECT)
+
+    assert [t.name for t in proj.tasks] == ["README", "What's new", "Final Output"]
+    assert proj.context == [Context(LinkType.WIKI_LINK, "llmake", "llmake")]
+    assert proj.tasks[1].dependency == ["README"]
+    assert proj.tasks[2].dependency == ["README", "What's new"]
+    assert proj.prompt[-2] == "# Tasks  "
+
+
+def test_links_after_task_section_belong_to_project():
+    proj = parse_markdown("# Tasks\n\n## A\n\n[[a]]\n\n# Notes\n\n[[b]]\n")
+
+    assert proj.tasks[0].context == [Context(LinkType.WIKI_LINK, "a", "a")]
+    assert proj.context == [Context(LinkType.WIKI_LINK, "b", "b")]
+    assert proj.prompt == ["# Tasks", "", "# Notes", "", "[[b]]"]
+
+
+def test_parse_markdown_from_threads():
+    expected = parse_markdown(TEST_PROJECT)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(parse_markdown, [TEST_PROJECT] * 64))
+    assert all(result == expected for result in results)
+
+
+def test_section_digest_only_changes_for_edited_task():
+    before = parse_markdown("# Tasks\n\n## A\n\nDo a.\n\n## B\n\nDo b after [[#A]].\n\n## C\n\nDo c.\n")
+    after = parse_markdown("# Tasks\n\n## A\n\nDo a.\n\n## B\n\nDo b after [[#A]].\n\n## C\n\nDo c again.\n")
+
+    digests = [[proj.section_digest(t) for t in proj.tasks] for proj in (before, after)]
+    assert digests[0][:2] == digests[1][:2]
+    assert digests[0][2] != digests[1][2]
+
+
+def test_wiki_links_with_alias_and_anchor():
+    [task] = parse_markdown(
+        "# Tasks\n\n## T\n\nSee [[notes#Setup|the setup]], [[notes#^block]] and [[#Other|other]].\n"
+    ).tasks
+
+    assert task.context == [
+        Context(LinkType.WIKI_LINK, "the setup", "notes#Setup"),
+        Context(LinkType.WIKI_LINK, "notes#^block", "notes#^block"),
+    ]
+    assert task.context[0].filename() == "notes.md"
+    assert task.context[1].anchor() == "^block"
+    assert task.dependency == ["Other"]
@@ -0,0 +1,56 @@
+import litellm
+import pytest
+
+from llmake import trace
+from llmake.cli.query import complete, stream_query
+from llmake.mock import MockSettings
+
+FAST = "mock/tokens=20,latency=0"
+
+
+@pytest.fixture(autouse=True)
+def workdir(workdir, monkeypatch):
+    monkeypatch.delenv("LLMAKE_HEDGE", raising=False)
+    return workdir
+
+
+def query(prompt: str, model: str) -> tuple[str, dict]:
+    with trace.step("query") as record:
+        result = complete(prompt, model, use_cache=False)
+    return result, record
+
+
+def test_answers_only_depend_on_the_prompt():
+    first, record = query("prompt", FAST)
+    assert len(first.split()) == 20
+    assert record["completion_tokens"] == 20
+    assert record["simulated_seconds"] == 0
+    assert query("prompt", FAST)[0] == first
+    assert query("other prompt", FAST)[0] != first
+
+
+def test_settings_come_from_the_model_name():
+    settings = MockSettings.parse("mock/slow,latency=2.5,error_rate=0.1")
+    assert (settings.latency, settings.error_rate, settings.tokens) == (2.5, 0.1, 100)
+    with pytest.raises(ValueError, match="Unknown mock model setting"):
+        MockSettings.parse("mock/latncy=1")
+
+
+def test_rate_limited_requests_fail_or_hedge(monkeypatch):
+    with pytest.raises(litellm.RateLimitError):
+        query("prompt", "mock/error_rate=1")
+
+    monkeypatch.setenv("LLMAKE_HEDGE", "10")
+    monkeypatch.setenv("LLMAKE_FALLBACK_MODEL", FAST)
+    result, record = query("prompt", "mock/error_rate=1")
+    assert result == query("prompt", FAST)[0]
+    assert record["hedge_won"]
+
+
+def test_streamed_answer_matches(workdir, monkeypatch):
+    monkeypatch.setenv("MODEL", f"{FAST},tokens_per_second=1000")
+    (workdir / "task.md").write_text("prompt")
+    with trace.step("query") as record:
+        stream_query("task.md", "result.md", use_cache=False)
+    assert (workdir / "result.md").read_text() == query("prompt", f"{FAST},tokens_per_second=1000")[0]
+    assert record["tokens"] == 20
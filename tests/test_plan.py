@@ -0,0 +1,69 @@
+import pytest
+
+from llmake import trace
+from llmake.markdown import parse_markdown
+from llmake.plan import plan_project
+from llmake.prompt import write_prompt
+
+PROJECT = """# Tasks
+
+## A
+
+Start.
+
+## B
+
+Continue [[#A]].
+
+## C
+
+Check [[#A]] slowly.
+
+## D
+
+Combine [[#B]] and [[#C]].
+"""
+
+
+@pytest.fixture
+def workdir(workdir):
+    for task, seconds in {"a": 10.0, "b": 5.0, "c": 20.0, "d": 10.0}.items():
+        trace.append_record(
+            {
+                "step": "query",
+                "task": task,
+                "model": "m",
+                "cache": "miss",
+                "ok": True,
+                "seconds": seconds,
+                "completion_tokens": 100,
+            }
+        )
+    return workdir
+
+
+def test_plan_finds_critical_path_and_wall_time(workdir):
+    plan = plan_project(parse_markdown(PROJECT), "m", concurrency=2)
+
+    assert [t.status for t in plan.tasks] == ["run"] * 4
+    assert [t.task.name for t in plan.critical_path] == ["A", "C", "D"]
+    assert plan.wall_seconds == 40.0
+    assert plan_project(parse_markdown(PROJECT), "m", concurrency=1).wall_seconds == 45.0
+    # Results not written yet count at the output tokens expected of their tasks.
+    assert plan.tasks[3].estimated and plan.tasks[3].input_tokens > 200
+    assert plan.tasks[0].cost is None
+
+
+def test_tasks_with_unchanged_prompts_do_not_run(workdir):
+    proj = parse_markdown(PROJECT)
+    for task in proj.tasks:
+        write_prompt(proj, task)
+        (workdir / task.result_filename()).write_text(f"result of {task.name}")
+
+    assert [t.status for t in plan_project(proj, "m", 2).tasks] == ["fresh"] * 4
+
+    (workdir / "result_c.md").write_text("changed")
+    plan = plan_project(proj, "m", 2)
+    assert [t.status for t in plan.tasks] == ["fresh", "fresh", "fresh", "run"]
+    assert plan.wall_seconds == 10.0
+    assert not plan.tasks[3].estimated
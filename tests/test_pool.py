@@ -0,0 +1,39 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llmake.pool import Pools, parse_pool, slot
+
+
+def test_slot_limits_concurrent_holders(tmp_path, monkeypatch):
+    pytest.importorskip("fcntl")
+    monkeypatch.setenv("LLMAKE_CACHE_DIR", str(tmp_path))
+    lock = threading.Lock()
+    running, peak = 0, 0
+
+    def hold(_):
+        nonlocal running, peak
+        with slot("llm_test", 2, poll=0.01):
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+
+    with ThreadPoolExecutor(6) as pool:
+        list(pool.map(hold, range(12)))
+    assert peak == 2
+
+
+def test_pools_by_model_and_host():
+    pools = Pools(4, 2, dict([parse_pool("gpt-4o=8"), parse_pool("example.com=1")]))
+
+    assert pools.query("gpt-4o") == ("llm_gpt-4o", 8)
+    assert pools.query(None) == ("llm_default", 4)
+    assert pools.fetch("https://example.com/a") == ("web_example-com", 1)
+    assert pools.fetch("https://docs.python.org/3/") == ("web_docs-python-org", 2)
+    with pytest.raises(ValueError, match="NAME=DEPTH"):
+        parse_pool("gpt-4o=0")
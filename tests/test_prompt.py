@@ -0,0 +1,148 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from llmake.cli.main import create_prompt
+from llmake.cli.query import prompt_messages
+from llmake.markdown import parse_markdown
+from llmake.prompt import CACHE_BREAKPOINT, assemble_prompt, write_prompt
+
+PROJECT = """# Context
+
+Shared [[notes]].
+
+# Tasks
+
+## First
+
+Write something.
+
+## Second
+
+Use [[notes]] and [[big]] with [[#First]].
+"""
+
+
+@pytest.fixture
+def workdir(workdir, monkeypatch):
+    # One token per word keeps the expected budgets easy to read.
+    monkeypatch.setattr("litellm.token_counter", lambda model, text: len(text.split()))
+    (workdir / "notes.md").write_text("note " * 10)
+    (workdir / "big.md").write_text("big " * 100)
+    (workdir / "result_first.md").write_text("first result")
+    return workdir
+
+
+def test_contexts_linked_twice_are_included_once(workdir):
+    proj = parse_markdown(PROJECT)
+    prompt = assemble_prompt(proj, proj.tasks[1])
+
+    assert prompt.count("## notes") == 1
+    assert "## big" in prompt
+    assert "Omitted" not in prompt
+
+
+def test_budget_drops_task_contexts_before_previous_results(workdir):
+    proj = parse_markdown(PROJECT)
+    prompt = assemble_prompt(proj, proj.tasks[1], budget=60)
+
+    assert "## big" not in prompt
+    assert "## notes" in prompt
+    assert "first result" in prompt
+    assert "- big (102 tokens)" in prompt
+
+    prompt = assemble_prompt(proj, proj.tasks[1], budget=20)
+    assert "first result" in prompt
+    assert "## notes" not in prompt
+
+
+def test_budget_below_the_task_text_warns(workdir, caplog):
+    proj = parse_markdown(PROJECT)
+    prompt = assemble_prompt(proj, proj.tasks[1], budget=5)
+
+    assert "Use [[notes]]" in prompt
+    assert "## notes" not in prompt
+    assert "first result" not in prompt
+    assert "text of Second take 14 tokens, over the budget of 5" in caplog.text
+
+
+def test_prefix_cache_layout_shares_prefix_between_tasks(workdir, monkeypatch):
+    proj = parse_markdown(PROJECT)
+    first, second = (assemble_prompt(proj, task, prefix_cache=True) for task in proj.tasks)
+
+    prefix = first.split(CACHE_BREAKPOINT)[0]
+    assert second.startswith(prefix + CACHE_BREAKPOINT)
+    assert "## notes" in prefix
+    assert second.index("## big") > second.index(CACHE_BREAKPOINT)
+
+    monkeypatch.setattr("litellm.utils.supports_prompt_caching", lambda model: True)
+    [message] = prompt_messages(second, "some-model")
+    assert message["content"][0] == {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}
+    assert CACHE_BREAKPOINT not in message["content"][1]["text"]
+
+    monkeypatch.setattr("litellm.utils.supports_prompt_caching", lambda model: False)
+    assert prompt_messages(second, "some-model") == [
+        {"content": second.replace(CACHE_BREAKPOINT + "\n", ""), "role": "user"}
+    ]
+
+
+def test_budget_keeps_the_shared_prefix(workdir, caplog):
+    proj = parse_markdown(PROJECT)
+    # Enough for the shared notes next to the text of the first task, not of the second.
+    first, second = (assemble_prompt(proj, task, budget=24, prefix_cache=True) for task in proj.tasks)
+
+    prefix = first.split(CACHE_BREAKPOINT)[0]
+    assert "## notes" in prefix
+    assert second.startswith(prefix + CACHE_BREAKPOINT)
+    assert "first result" not in second
+    assert "of First" not in caplog.text
+    assert "with the shared contexts, of Second take 26 tokens, over the budget of 24" in caplog.text
+
+
+def test_written_prompt_matches_assembled_prompt(workdir):
+    proj = parse_markdown(PROJECT)
+    task = proj.tasks[1]
+    write_prompt(proj, task, prefix_cache=True)
+    assert Path(task.filename()).read_text() == assemble_prompt(proj, task, prefix_cache=True)
+
+    os.utime(task.filename(), ns=(0, 0))
+    write_prompt(proj, task, prefix_cache=True)
+    assert Path(task.filename()).stat().st_mtime_ns == 0
+    assert list(workdir.glob(".*.tmp")) == []
+
+
+def test_depfile_lists_the_files_actually_read(workdir):
+    (workdir / "notes.md").unlink()
+    (workdir / "sub").mkdir()
+    (workdir / "sub" / "notes taken.md").write_text("moved notes")
+    (workdir / "project.md").write_text(PROJECT)
+
+    create_prompt("project.md", "second", depfile="second.d", budget=50)
+    assert "moved notes" in Path("task_second.md").read_text()
+    assert "big big" not in Path("task_second.md").read_text()
+    # big.md did not fit the budget, but its content decides whether it does.
+    assert (
+        Path("second.d").read_text()
+        == "task_second.md: \\\n  sub/notes\\ taken.md \\\n  big.md \\\n  result_first.md\n"
+    )
+
+
+def test_create_prompt_writes_every_named_or_ready_task(workdir, capsys):
+    (workdir / "project.md").write_text(PROJECT)
+
+    create_prompt("project.md", "first", "second")
+    assert "Write something." in Path("task_first.md").read_text()
+    assert "first result" in Path("task_second.md").read_text()
+
+    Path("task_first.md").unlink()
+    Path("task_second.md").unlink()
+    Path("result_first.md").unlink()
+    create_prompt("project.md", all_tasks=True)
+    assert Path("task_first.md").exists()
+    assert not Path("task_second.md").exists()
+    assert "Skipping Second, missing result_first.md" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        create_prompt("project.md", "first", "third")
+    assert "Cannot find task third" in capsys.readouterr().out
@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from llmake import trace
+from llmake.cli.query import RequestCancelledError, cancel_requests, complete, hedge_delay, stream_query
+
+LATENCY = {"slow": 5.0, "fast": 0.01, "broken": None}
+
+
+LOOPS = set()
+# Models of the requests cancelled before they answered.
+CANCELLED = []
+
+
+async def fake_acompletion(model, messages, **params):
+    LOOPS.add(asyncio.get_running_loop())
+    latency = LATENCY[model]
+    if latency is None:
+        raise ConnectionError(model)
+    try:
+        await asyncio.sleep(latency)
+    except asyncio.CancelledError:
+        CANCELLED.append(model)
+        raise
+    message = SimpleNamespace(content=f"answer from {model}")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture(autouse=True)
+def mocked_litellm(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLMAKE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("litellm.acompletion", fake_acompletion)
+    monkeypatch.setenv("LLMAKE_HEDGE", "0.05")
+    monkeypatch.setenv("LLMAKE_FALLBACK_MODEL", "fast")
+    monkeypatch.setattr("llmake.cli.query._hedge_delays", {})
+    yield
+    cancel_requests.clear()
+
+
+def hedged_query(model: str) -> tuple[str, dict]:
+    with trace.step("query") as record:
+        result = complete("prompt", model, use_cache=False)
+    return result, record
+
+
+def test_fast_response_sends_no_hedge():
+    result, record = hedged_query("fast")
+    assert result == "answer from fast"
+    assert "hedged" not in record
+
+
+def test_slow_response_loses_to_fallback():
+    result, record = hedged_query("slow")
+    assert result == "answer from fast"
+    assert record["hedged"] and record["hedge_won"]
+    assert record["seconds"] < 1
+    assert trace.summarize(trace.load_trace(), "step")["query"]["hedge_wins"] == 1
+
+
+def test_fallback_answers_are_not_cached_for_the_model():
+    for _ in range(2):
+        with trace.step("query") as record:
+            assert complete("prompt", "slow") == "answer from fast"
+        assert record["cache"] == "miss"
+    complete("prompt", "fast")
+    with trace.step("query") as record:
+        complete("prompt", "fast")
+    assert record["cache"] == "hit"
+
+
+def test_failed_request_falls_back_at_once(monkeypatch):
+    monkeypatch.setenv("LLMAKE_HEDGE", "10")
+    result, record = hedged_query("broken")
+    assert result == "answer from fast"
+    assert record["seconds"] < 1
+
+
+def test_timeout_covers_hedges(monkeypatch):
+    monkeypatch.setenv("LLMAKE_FALLBACK_MODEL", "slow")
+    monkeypatch.setenv("LLMAKE_TIMEOUT", "0.2")
+    with pytest.raises(TimeoutError):
+        hedged_query("slow")
+    assert trace.load_trace()[0]["ok"] is False
+
+
+@pytest.mark.parametrize("stop", ["timeout", "cancel"])
+def test_giving_up_before_the_hedge_cancels_the_request(monkeypatch, stop):
+    monkeypatch.setenv("LLMAKE_HEDGE", "10")
+    if stop == "timeout":
+        monkeypatch.setenv("LLMAKE_TIMEOUT", "0.2")
+    else:
+        threading.Timer(0.2, cancel_requests.set).start()
+    CANCELLED.clear()
+    with pytest.raises((TimeoutError, RequestCancelledError)):
+        hedged_query("slow")
+    # The request is cancelled on the thread of the event loop.
+    deadline = time.monotonic() + 2
+    while not CANCELLED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert CANCELLED == ["slow"]
+
+
+def test_percentile_delay_from_trace(monkeypatch):
+    assert hedge_delay("m", "p95") is None
+    for i in range(100):
+        trace.append_record({"step": "query", "model": "m", "cache": "miss", "ok": True, "seconds": float(i)})
+    trace.append_record({"step": "query", "model": "m", "cache": "hit", "ok": True, "seconds": 1000.0})
+    # Computed once in a while, not for every query.
+    assert hedge_delay("m", "p95") is None
+    monkeypatch.setattr("llmake.cli.query.HEDGE_DELAY_MAX_AGE", 0.0)
+    assert hedge_delay("m", "p95") == 95.0
+    assert hedge_delay("other", "p95") is None
+    assert hedge_delay("m", "2.5") == 2.5
+
+
+def test_cancel_abandons_requests_in_flight(monkeypatch):
+    monkeypatch.delenv("LLMAKE_HEDGE")
+    threading.Timer(0.1, cancel_requests.set).start()
+    with pytest.raises(RequestCancelledError):
+        hedged_query("slow")
+    assert trace.load_trace()[0]["seconds"] < 1
+
+
+def test_queries_share_one_event_loop(monkeypatch):
+    monkeypatch.delenv("LLMAKE_HEDGE")
+    LOOPS.clear()
+    hedged_query("fast")
+    hedged_query("fast")
+    assert len(LOOPS) == 1
+
+
+def fake_stream(model, messages, **params):
+    for word in ["one", " two", " three"]:
+        time.sleep(0.05)
+        # The answer only replaces the result once complete.
+        assert Path("result.md").read_text() == "old result"
+        assert len(list(Path().glob(".result.md.*.tmp"))) == 1
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))], usage=None)
+    yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=5, completion_tokens=7))
+
+
+def test_stream_writes_the_result_once_complete(workdir, monkeypatch):
+    monkeypatch.setenv("MODEL", "m")
+    monkeypatch.setattr("litellm.completion", fake_stream)
+    Path("task.md").write_text("prompt")
+    Path("result.md").write_text("old result")
+
+    with trace.step("query") as record:
+        stream_query("task.md", "result.md", use_cache=False)
+    assert Path("result.md").read_text() == "one two three"
+    assert not list(Path().glob(".result.md.*"))
+    assert record["time_to_first_token"] >= 0.05
+    assert record["tokens"] == record["completion_tokens"] == 7
+
+
+def endless_stream(model, messages, **params):
+    while True:
+        time.sleep(0.05)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="word "))], usage=None)
+
+
+@pytest.mark.parametrize("stop", ["timeout", "cancel"])
+def test_stream_is_given_up_like_other_queries(workdir, monkeypatch, stop):
+    monkeypatch.setenv("MODEL", "m")
+    monkeypatch.setattr("litellm.completion", endless_stream)
+    if stop == "timeout":
+        monkeypatch.setenv("LLMAKE_TIMEOUT", "0.2")
+    else:
+        threading.Timer(0.2, cancel_requests.set).start()
+    Path("task.md").write_text("prompt")
+    Path("result.md").write_text("old result")
+
+    with pytest.raises((TimeoutError, RequestCancelledError)):
+        stream_query("task.md", "result.md", use_cache=False)
+    assert Path("result.md").read_text() == "old result"
+    assert not list(Path().glob(".result.md.*"))
@@ -0,0 +1,51 @@
+import pytest
+
+from llmake.markdown import parse_markdown
+from llmake.prompt import OMISSION, assemble_prompt
+from llmake.retrieval import ChunkIndex, chunk_index, split_chunks
+
+TOPICS = ["bananas grow in warm climates", "compilers translate source code", "glaciers carve deep valleys"]
+REFERENCE = "".join(f"{topic.capitalize()}. " * 60 + "\n\n" for topic in TOPICS * 3)
+
+PROJECT = """# Tasks
+
+## Compilers
+
+Explain how compilers translate code, see [[reference]].
+"""
+
+
+@pytest.fixture
+def workdir(workdir):
+    (workdir / "reference.md").write_text(REFERENCE)
+    return workdir
+
+
+def test_chunks_split_between_paragraphs():
+    data = REFERENCE.encode()
+    chunks = split_chunks(data)
+    assert len(chunks) == 9
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+    assert all(data[end - 2 : end] == b"\n\n" for _, end in chunks)
+
+
+def test_top_chunks_match_the_query():
+    data = REFERENCE.encode()
+    index = ChunkIndex.build(data)
+    top = index.top(["glaciers", "valleys"], 3)
+    assert [data[start:end].decode().startswith("Glaciers") for start, end in top] == [True] * 3
+    assert index.scores(["unrelated"]).sum() == 0
+
+
+def test_prompt_keeps_only_relevant_chunks(workdir):
+    proj = parse_markdown(PROJECT)
+    prompt = assemble_prompt(proj, proj.tasks[0], chunks=2)
+
+    assert prompt.count("Compilers translate source code.") == 120
+    assert "Bananas" not in prompt
+    assert OMISSION in prompt
+    assert len(prompt) < len(REFERENCE) / 3
+
+    [cached] = (workdir / ".llmake" / "retrieval").glob("*.npz")
+    assert ChunkIndex.load(cached).vocabulary == chunk_index(workdir / "reference.md").vocabulary
+    assert assemble_prompt(proj, proj.tasks[0], chunks=20).count("Bananas") == 180
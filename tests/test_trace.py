@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llmake import trace
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLMAKE_CACHE_DIR", str(tmp_path))
+
+
+def query_step(i: int):
+    with trace.step("query", task=f"t{i % 4}"):
+        trace.annotate(prompt_tokens=10, cost=0.5, cache="hit" if i % 2 else "miss")
+
+
+def test_concurrent_steps_append_whole_records():
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(query_step, range(200)))
+    with pytest.raises(RuntimeError), trace.step("create-prompt", task="t0"):
+        raise RuntimeError
+
+    records = trace.load_trace()
+    assert len(records) == 201
+
+    by_step = trace.summarize(records, "step")
+    assert by_step["query"]["steps"] == 200
+    assert by_step["query"]["cache_hits"] == 100
+    assert by_step["query"]["prompt_tokens"] == 2000
+    assert by_step["create-prompt"]["failed"] == 1
+    assert trace.summarize(records, "task")["t0"]["steps"] == 51
+
+    events = trace.chrome_trace(records)["traceEvents"]
+    assert {e["cat"] for e in events} == {"query", "create-prompt"}
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+
+def test_annotate_outside_a_step_is_ignored():
+    trace.annotate(cost=1.0)
+    assert trace.load_trace() == []
+
+
+def test_trace_moves_aside_past_its_size_limit(monkeypatch):
+    monkeypatch.setenv("LLMAKE_TRACE_MAX_BYTES", "2000")
+    for i in range(40):
+        query_step(i)
+
+    path = trace.trace_path()
+    assert path.stat().st_size <= 2000
+    assert trace.previous_path(path).stat().st_size > 2000
+    records = trace.load_trace()
+    # Only the two latest traces are kept, in order.
+    assert len(records) < 40
+    assert [r["start"] for r in records] == sorted(r["start"] for r in records)
+    assert records[-1]["task"] == "t3"
+    assert trace.load_trace(tail=1 << 20) == records
+    assert trace.load_trace(tail=path.stat().st_size + 500)[-1] == records[-1]
+    assert records[-1]["process_max_rss_kb"] > 0
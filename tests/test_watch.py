@@ -0,0 +1,66 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from llmake.markdown import parse_markdown
+from llmake.watch import affected_tasks, context_readers, watch
+
+PROJECT = """# Tasks
+
+## First
+
+Read [[notes]].
+
+## Second
+
+Continue [[#First]].
+
+## Third
+
+Read [[other]] after [[#First]].
+"""
+
+
+class StopWatchingError(Exception):
+    pass
+
+
+@pytest.fixture
+def workdir(workdir):
+    (workdir / "project.md").write_text(PROJECT)
+    (workdir / "notes.md").write_text("notes")
+    (workdir / "other.md").write_text("other")
+    return workdir
+
+
+def names(tasks):
+    return [task.name for task in tasks]
+
+
+def test_affected_tasks(workdir):
+    proj = parse_markdown(PROJECT)
+    digests = {task.name: proj.section_digest(task) for task in proj.tasks}
+    readers = context_readers(proj)
+
+    assert affected_tasks(proj, digests, readers, set()) == []
+    assert names(affected_tasks(proj, digests, readers, {Path("notes.md")})) == ["First", "Second", "Third"]
+    assert names(affected_tasks(proj, digests, readers, {Path("other.md")})) == ["Third"]
+
+    edited = parse_markdown(PROJECT.replace("Continue", "Go on from"))
+    assert names(affected_tasks(edited, digests, readers, {Path("project.md")})) == ["Second"]
+
+
+def test_watch_rebuilds_after_changes(workdir):
+    builds = []
+
+    def build(proj, tasks):
+        builds.append(names(tasks))
+        if len(builds) == 1:
+            threading.Timer(0.1, lambda: (workdir / "other.md").write_text("changed")).start()
+        else:
+            raise StopWatchingError
+
+    with pytest.raises(StopWatchingError):
+        watch("project.md", build, interval=0.01, debounce=0.05)
+    assert builds == [["First", "Second", "Third"], ["Third"]]
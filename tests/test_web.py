@@ -0,0 +1,86 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llmake.web import WebCache, fetch_pages
+
+PAGES = {
+    "/a": "<html><body><p>Article A</p></body></html>",
+    "/b": "<html><body><p>Article B</p></body></html>",
+}
+
+
+def strip_tags(url: str, html: str) -> str:
+    return re.sub(r"<[^>]+>", "", html)
+
+
+class Handler(BaseHTTPRequestHandler):
+    statuses: list[int] = []
+    # Status to answer with instead of the page, by path.
+    failures: dict[str, int] = {}
+
+    def do_GET(self):  # noqa: N802
+        body = PAGES.get(self.path)
+        if self.path in self.failures:
+            self.send_response(self.failures[self.path])
+        elif body is None:
+            self.send_response(404)
+        elif self.headers.get("If-None-Match") == f'"{self.path}"':
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header("ETag", f'"{self.path}"')
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode())
+            self.statuses.append(200)
+            return
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.statuses.append(self._status)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.statuses = []
+    Handler.failures = {}
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_fetch_pages_revalidates_cached_copies(server, tmp_path):
+    cache = WebCache(tmp_path)
+    urls = [f"{server}/a", f"{server}/b", f"{server}/a", f"{server}/missing"]
+
+    texts = fetch_pages(urls, extractor=strip_tags, cache=cache)
+    assert texts == {f"{server}/a": "Article A", f"{server}/b": "Article B", f"{server}/missing": None}
+    assert sorted(Handler.statuses) == [200, 200, 404]
+
+    Handler.statuses = []
+    assert fetch_pages(urls, extractor=strip_tags, cache=cache) == texts
+    assert sorted(Handler.statuses) == [304, 304, 404]
+
+
+def test_cached_copy_only_stands_in_for_server_errors(server, tmp_path, caplog):
+    cache = WebCache(tmp_path)
+    url = f"{server}/a"
+    assert fetch_pages([url], extractor=strip_tags, cache=cache) == {url: "Article A"}
+
+    Handler.failures = {"/a": 503}
+    assert fetch_pages([url], extractor=strip_tags, cache=cache) == {url: "Article A"}
+    assert "using the copy cached earlier" in caplog.text
+
+    Handler.failures = {"/a": 410}
+    assert fetch_pages([url], extractor=strip_tags, cache=cache) == {url: None}